@@ -5,19 +5,33 @@ import sys
 
 import typer
 from rich.console import Console
-from pydantic import BaseModel
-from pydantic.dataclasses import dataclass
-import yaml
-from typing import List, Optional, Mapping, Any
+from typing import TYPE_CHECKING, Tuple
+import json
+import os
 import pathlib
-import subprocess
+import time
 from enum import Enum
 
+if TYPE_CHECKING:
+    from benchmark_keeper.models import AppConfig, LocalConfig, RepoConfig
+
 LOCAL_DIR = ".benchk.local"
 TRACKED_DIR = ".benchk"
 REPORT_FILE = "report.yml"
+RUNS_DIR = "runs"
 LOCAL_CONFIG = "local_config.yml"
 REPO_CONFIG = "repo_config.yml"
+RUN_CACHE = "run_cache.sqlite"
+REPORT_LOCK = "report.lock"
+DIGEST_CACHE = "digest_cache.sqlite"
+LOCAL_RUNS = "local_runs.sqlite"
+WORKTREE_DIR = "worktrees"
+BACKFILL_STATE = "backfill.json"
+PROFILE_DIR = "profiles"
+CONFIG_CACHE = "config_cache.json"
+REPORT_CACHE = "report_cache.json"
+SERVE_SOCKET = "serve.sock"
+PENDING_REPORT = "pending_report.yml"
 
 app = typer.Typer(
     name="benchmark-keeper",
@@ -27,6 +41,12 @@ app = typer.Typer(
 console = Console()
 
 
+@app.callback()
+def _callback():
+    # Keeps the app a group of commands while only some of them are loaded
+    pass
+
+
 class Color(str, Enum):
     white = "white"
     red = "red"
@@ -35,93 +55,137 @@ class Color(str, Enum):
     yellow = "yellow"
     green = "green"
 
+    def __str__(self) -> str:
+        # Interpolated into rich markup, where Python 3.11+ would format it as "Color.red"
+        return self.value
+
 
 def print_error(error: str, message: str = ""):
     console.print(f"[{Color.red}]{error}[/{Color.red}] {message}")
 
 
-class LocalConfig(BaseModel):
-    machine_name: str
-    active_experiment: str | None
-
-
-default_local_config = LocalConfig(machine_name="MyMachine", active_experiment=None)
-
-
-class Experiment(BaseModel):
-    name: str
-    version: int = 1
-    build_script: str | None = None
-    test_script: str | None = None
-    benchmark_script: str
-    watch_files: List[str] = []
-
-
-class RepoConfig(BaseModel):
-    experiments: List[Experiment]
-
+class OutputFormat(str, Enum):
+    json = "json"  # One JSON document mapping benchmark names to results
+    jsonl = "jsonl"  # One JSON object per line: a result with an additional "name"
 
-default_repo_config = RepoConfig(experiments=[])
 
-
-@dataclass
-class AppConfig:
-    root_directory: pathlib.Path
-    local_config: LocalConfig
-    repo_config: RepoConfig
-
-    @property
-    def active_experiment(self) -> Optional[Experiment]:
-        return next(
-            filter(
-                lambda x: x.name == self.local_config.active_experiment,
-                self.repo_config.experiments,
-            ),
-            None,
-        )
+class Storage(str, Enum):
+    report = "report"  # All runs in REPORT_FILE
+    sharded = "sharded"  # One file per (experiment, experiment_version) in RUNS_DIR
+    notes = "notes"  # One note per commit (see notes.py), uncommitted runs in PENDING_REPORT
 
 
 _root_path: pathlib.Path | None = None
 
 
 def get_path():
+    """Root of the enclosing git repository, found without spawning git"""
     global _root_path
     if _root_path is None:
-        proc = subprocess.run(
-            "git rev-parse --show-toplevel",
-            shell=True,
-            check=True,
-            capture_output=True,
-            text=True,
+        cwd = pathlib.Path.cwd()
+        _root_path = next(
+            (path for path in (cwd, *cwd.parents) if path.joinpath(".git").exists()),
+            None,
         )
-        _root_path = pathlib.Path(proc.stdout.strip())
+        if _root_path is None:
+            print_error("Not a git repository")
+            raise typer.Exit(1)
     return _root_path
 
 
-def write_local_config(config: LocalConfig):
+def write_local_config(config: "LocalConfig"):
+    import yaml
+
     dir_path = get_path().joinpath(LOCAL_DIR)
     dir_path.touch()
     with open(dir_path.joinpath(LOCAL_CONFIG), "w") as f:
-        yaml.dump(config.model_dump(), f)
+        yaml.dump(config.model_dump(mode="json"), f)
     if _config is not None:
         _config.local_config = config
 
 
-def write_repo_config(config: RepoConfig):
+def write_repo_config(config: "RepoConfig"):
+    import yaml
+
     dir_path = get_path().joinpath(TRACKED_DIR)
     dir_path.touch()
     with open(dir_path.joinpath(REPO_CONFIG), "w") as f:
-        yaml.dump(config.model_dump(), f)
+        yaml.dump(config.model_dump(mode="json"), f)
     if _config is not None:
         _config.repo_config = config
 
 
-_config: AppConfig | None = None
+# Files modified this recently may still change without changing their mtime
+RACY_NS = 2 * 10**9
+
+
+def stat_key(path: str | os.PathLike) -> Tuple[int, int, int]:
+    """(size, mtime_ns, inode) of a file, which its cached contents are keyed by"""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
 
+def is_racy(key: Tuple[int, int, int]) -> bool:
+    """Whether the file may still change without changing its key, so it mustn't be cached"""
+    return time.time_ns() - key[1] <= RACY_NS
 
-def get_config() -> AppConfig:
+
+def _read_configs(
+    local_config_path: pathlib.Path, repo_config_path: pathlib.Path
+) -> Tuple["LocalConfig", "RepoConfig"]:
+    """
+    Parsed configs are cached as JSON in LOCAL_DIR, keyed by the stat_key of both files
+    and the fields of the models, so most invocations don't need yaml.
+    """
+    from pydantic import ValidationError
+
+    from benchmark_keeper.models import LocalConfig, RepoConfig, schema_digest
+
+    key = [
+        list(stat_key(local_config_path)),
+        list(stat_key(repo_config_path)),
+        schema_digest(LocalConfig, RepoConfig),
+    ]
+    cache_path = local_config_path.parent.joinpath(CONFIG_CACHE)
+    try:
+        cached = json.loads(cache_path.read_text())
+        if cached["key"] == key:
+            return LocalConfig(**cached["local"]), RepoConfig(**cached["repo"])
+    except (OSError, ValueError, KeyError, TypeError, ValidationError):
+        pass
+
+    import yaml
+
+    with open(local_config_path, "r") as f:
+        local_config = LocalConfig(**yaml.safe_load(f))
+    with open(repo_config_path, "r") as f:
+        repo_config = RepoConfig(**yaml.safe_load(f))
+
+    if not any(is_racy(k) for k in key[:2]):
+        cache_path.write_text(
+            json.dumps(
+                {
+                    "key": key,
+                    "local": local_config.model_dump(mode="json"),
+                    "repo": repo_config.model_dump(mode="json"),
+                }
+            )
+        )
+    return local_config, repo_config
+
+
+_config: "AppConfig | None" = None
+
+
+def get_config() -> "AppConfig":
     global _config
     if _config is None:
+        from benchmark_keeper.models import (
+            AppConfig,
+            default_local_config,
+            default_repo_config,
+        )
+
         path = get_path()
 
         local_config_path = path.joinpath(LOCAL_DIR, LOCAL_CONFIG)
@@ -132,55 +196,100 @@ def get_config() -> AppConfig:
                 f.write("*")
         if not local_config_path.exists():
             write_local_config(default_local_config)
-        with open(local_config_path, "r") as f:
-            local_config = LocalConfig(**yaml.safe_load(f))
 
         repo_config_path = path.joinpath(TRACKED_DIR, REPO_CONFIG)
         path.joinpath(TRACKED_DIR).mkdir(exist_ok=True)
         if not repo_config_path.exists():
             write_repo_config(default_repo_config)
-        with open(repo_config_path, "r") as f:
-            repo_config = RepoConfig(**yaml.safe_load(f))
+
+        local_config, repo_config = _read_configs(local_config_path, repo_config_path)
         _config = AppConfig(path, local_config, repo_config)
 
-    if _config.local_config.active_experiment is None and repo_config.experiments:
-        console.print(
-            f'No active experiment set. Using "{repo_config.experiments[0].name}"'
-        )
-        _config.local_config.active_experiment = repo_config.experiments[0].name
+    experiments = _config.repo_config.experiments
+    if _config.local_config.active_experiment is None and experiments:
+        console.print(f'No active experiment set. Using "{experiments[0].name}"')
+        _config.local_config.active_experiment = experiments[0].name
         write_local_config(_config.local_config)
 
     return _config
 
 
-class BenchmarkResult(BaseModel):
-    """
-    The result of one benchmark. target is (for now) measured in ns.
-    """
-
-    target: float
-    labels: List[str] = []
-    unstructured: Mapping[str, Any] = {}
-
+def reset_config():
+    """Makes the next get_config read the config files again (if they changed)"""
+    global _config
+    _config = None
 
-class BenchmarkRun(BaseModel):
-    """
-    Contains results of multiple benchmarks within one (experiment,version).
-    The tag uniquely identifies this run.
-    """
 
-    tag: str
-    experiment: str
-    experiment_version: int
-    machine: str
-    benchmarks: Mapping[str, BenchmarkResult]
-    file_digest: str = ""
+_custom_loaded = False
 
 
-class Report(BaseModel):
+def load_custom_code():
     """
-    Persisted runs across different experiments/versions.
-    Should contain, for every (experiment, experiment_version) pair at most one run.
+    Executes TRACKED_DIR/custom.py (once), which may register aggregators or commands.
+    Only called when one of those is needed, since it runs arbitrary code.
     """
-
-    runs: List[BenchmarkRun]
+    global _custom_loaded
+    if _custom_loaded:
+        return
+    _custom_loaded = True
+
+    custom_code_path = get_path().joinpath(TRACKED_DIR, "custom.py")
+    if custom_code_path.exists():
+        import importlib.util
+
+        try:
+            sys.dont_write_bytecode = True
+            spec = importlib.util.spec_from_file_location("custom", custom_code_path)
+            foo = importlib.util.module_from_spec(spec)  # type: ignore
+            spec.loader.exec_module(foo)  # type: ignore
+        except Exception as e:
+            raise RuntimeError("Error loading custom code")
+
+
+class Normalization(str, Enum):
+    """How results of other machines are rescaled to the local machine"""
+
+    calibration = "calibration"  # By the ratio of calibration results
+    fit = "fit"  # By factors fitted from commits measured on several machines
+
+
+class Statistic(str, Enum):
+    target = "target"
+    median = "median"
+    mean = "mean"
+    min = "min"
+    mad = "mad"
+    ci_low = "ci_low"
+    ci_high = "ci_high"
+
+
+# Name of a result's own target among its metrics
+TARGET_METRIC = "target"
+
+
+# Models of configs and runs, defined in models.py and imported on first access,
+# e.g. `from benchmark_keeper import BenchmarkRun`. The help of all commands doesn't need them.
+_MODELS = {
+    "LocalConfig",
+    "default_local_config",
+    "Experiment",
+    "RepoConfig",
+    "default_repo_config",
+    "AppConfig",
+    "SampleStats",
+    "Metric",
+    "BenchmarkResult",
+    "ResourceUsage",
+    "Fingerprint",
+    "BenchmarkRun",
+    "Report",
+}
+
+
+def __getattr__(name: str):
+    if name in _MODELS:
+        from benchmark_keeper import models
+
+        value = globals()[name] = getattr(models, name)
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
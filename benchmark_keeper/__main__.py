@@ -1,23 +1,23 @@
 """Entry point"""
 
-import benchmark_keeper.cmd
-from benchmark_keeper import app, TRACKED_DIR, get_path
-import importlib.util
 import sys
 
+from benchmark_keeper import app, load_custom_code
+from benchmark_keeper.cmd import COMMANDS, load_commands, register_summaries
 
-def main():
-    # Import custom code
 
-    custom_code_path = get_path().joinpath(TRACKED_DIR, "custom.py")
-    if custom_code_path.exists():
-        try:
-            sys.dont_write_bytecode = True
-            spec = importlib.util.spec_from_file_location("custom", custom_code_path)
-            foo = importlib.util.module_from_spec(spec)  # type: ignore
-            spec.loader.exec_module(foo)  # type: ignore
-        except Exception as e:
-            raise RuntimeError("Error loading custom code")
+def main():
+    name = next((arg for arg in sys.argv[1:] if not arg.startswith("-")), None)
+    if name in COMMANDS:
+        load_commands(name)
+    else:
+        # Listing commands (--help) or a command defined in custom code
+        register_summaries()
+        load_custom_code()
 
     # Run app
     app()
+
+
+if __name__ == "__main__":
+    main()
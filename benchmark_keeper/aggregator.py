@@ -1,12 +1,28 @@
 """Defines methods to aggregate results from multiple benchmarks, possibly by ranking runs"""
 
-from typing import List, Dict, Any, Mapping, Callable
+import copy
+from typing import List, Dict, Any, Mapping, Callable, Collection, Optional
 from abc import ABC, abstractmethod
-from functools import reduce
-from benchmark_keeper import BenchmarkResult
+from operator import attrgetter
+
+import typer
+
+from benchmark_keeper import BenchmarkResult, Statistic, load_custom_code, print_error
+from benchmark_keeper.matrix import ResultMatrix
 
 
 class Aggregator(ABC):
+    # Which statistic of a benchmark result is aggregated
+    statistic: Statistic = Statistic.target
+    # Whether the score of a run depends on its own results only, not on the other runs
+    independent: bool = False
+    # Unit and direction of the aggregated metric (see BenchmarkResult.metrics)
+    metric_unit: str = "unit"
+    metric_lower_is_better: bool = True
+
+    def value(self, result: BenchmarkResult) -> float:
+        return result.statistic(self.statistic)
+
     @abstractmethod
     def aggregate(self, results: List[Mapping[str, BenchmarkResult]]) -> List[float]:
         """
@@ -20,26 +36,54 @@ class Aggregator(ABC):
         """
         pass
 
+    def aggregate_groups(
+        self,
+        results: List[Mapping[str, BenchmarkResult]],
+        groups: List[Mapping[str, Collection[str]]],
+    ) -> Dict[str, Dict[int, float]]:
+        """
+        Aggregates every group of benchmarks (e.g. all benchmarks with a label) separately.
+
+        Args:
+            results (List[Mapping[str, BenchmarkResult]]): Benchmark results of every run.
+            groups (List[Mapping[str, Collection[str]]]): For every run, the benchmark names in each group.
+
+        Returns:
+            Dict[str, Dict[int, float]]: For every group, the aggregated metric of every run (by index) with results in it.
+        """
+        aggregated: Dict[str, Dict[int, float]] = {}
+        for group in sorted(set().union(*groups)):
+            runs = [
+                (i, {n: res[n] for n in names if n in res})
+                for i, (res, g) in enumerate(zip(results, groups))
+                if (names := g.get(group))
+            ]
+            runs = [(i, res) for i, res in runs if res]
+            scores = self.aggregate([res for _, res in runs])
+            aggregated[group] = {i: score for (i, _), score in zip(runs, scores)}
+        return aggregated
+
     def unit(self) -> str:
         """
         Returns the unit of the aggregated metrics.
-        Defaults to "unit".
+        Defaults to the unit of the selected metric ("unit" for targets).
         This can be overridden by subclasses to provide specific units.
 
         Returns:
             str: The unit of the aggregated metrics.
         """
-        return "unit"
+        return self.metric_unit
 
     def lower_is_better(self) -> bool:
         """
         Indicates whether lower values are better for the aggregated metrics.
+        Defaults to the direction of the selected metric.
         This can be overridden by subclasses to specify if lower is better.
 
         Returns:
             bool: True if lower values are better, False otherwise.
         """
-        return True
+        return self.metric_lower_is_better
 
 
 class IndependentAggregator(Aggregator):
@@ -47,6 +91,8 @@ class IndependentAggregator(Aggregator):
     Aggregates benchmark results from multiple runs independently.
     """
 
+    independent = True
+
     def __init__(self, agg_func: Callable[[Mapping[str, BenchmarkResult]], float]):
         self.agg_func = agg_func
 
@@ -54,32 +100,64 @@ class IndependentAggregator(Aggregator):
         return list(map(self.agg_func, results))
 
 
-class RankingAggregator(Aggregator):
+class MatrixAggregator(Aggregator):
     """
-    Aggregates benchmark results from multiple runs by ranking them.
+    Aggregates results packed into a runs x benchmarks matrix,
+    so the aggregation runs as batch operations instead of per result.
     """
 
-    def aggregate(self, results: List[Mapping[str, BenchmarkResult]]) -> List[float]:
-        score = [0.0] * len(results)
+    @abstractmethod
+    def aggregate_matrix(self, matrix: ResultMatrix) -> List[float]:
+        pass
 
-        common_benchmarks = reduce(
-            lambda x, y: x.intersection(y), [set(res.keys()) for res in results]
+    def aggregate(self, results: List[Mapping[str, BenchmarkResult]]) -> List[float]:
+        value = (
+            attrgetter("target") if self.statistic == Statistic.target else self.value
         )
-        if not common_benchmarks:
-            return score
+        return self.aggregate_matrix(ResultMatrix(results, value))
+
+
+class MeanAggregator(MatrixAggregator):
+    """
+    Mean of all benchmark results of a run.
+    """
+
+    independent = True
+
+    def aggregate_matrix(self, matrix: ResultMatrix) -> List[float]:
+        return matrix.mean()
+
+
+class GeometricMeanAggregator(MatrixAggregator):
+    """
+    Geometric mean of all benchmark results of a run.
+    """
+
+    independent = True
+
+    def aggregate_matrix(self, matrix: ResultMatrix) -> List[float]:
+        return matrix.geometric_mean()
+
 
-        for bench in common_benchmarks:
-            sr = sorted(
-                list(range(len(results))), key=lambda x: results[x][bench].target
-            )
-            for rank, idx in enumerate(sr):
-                score[idx] += rank  # Could square this to change weighting
+class NormalizedAggregator(MatrixAggregator):
+    """
+    Geometric mean speedup relative to the first (oldest) run.
+    """
+
+    def aggregate_matrix(self, matrix: ResultMatrix) -> List[float]:
+        return matrix.normalized(baseline=0)
+
+    def unit(self):
+        return "x first run"
 
-        # Normalize scores with len(results)
-        for i in range(len(score)):
-            score[i] /= len(common_benchmarks)
 
-        return score
+class RankingAggregator(MatrixAggregator):
+    """
+    Aggregates benchmark results from multiple runs by ranking them.
+    """
+
+    def aggregate_matrix(self, matrix: ResultMatrix) -> List[float]:
+        return matrix.mean_rank()
 
     def unit(self):
         return "mean rank"
@@ -94,13 +172,27 @@ def configure_ranking_agg():
 
 aggregator_presets: Dict[str, Callable[..., Aggregator]] = {
     "ranking": configure_ranking_agg,
-    "mean": lambda: IndependentAggregator(
-        lambda x: sum(map(lambda y: y.target, x.values())) / len(x)
-    ),
+    "mean": MeanAggregator,
+    "geomean": GeometricMeanAggregator,
+    "normalized": NormalizedAggregator,
 }
 
 DEFAULT_AGGREGATOR = "mean"
 
 
 def register_aggregator(agg: Aggregator, name: str):
-    aggregator_presets[name] = lambda: agg
+    # Every lookup gets its own copy, since callers set statistic and metric on it
+    # (serve answers many queries with the same presets)
+    aggregator_presets[name] = lambda: copy.copy(agg)
+
+
+def get_aggregator(name: Optional[str]) -> Aggregator:
+    # Custom code may register presets
+    load_custom_code()
+    if (name := name or DEFAULT_AGGREGATOR) not in aggregator_presets:
+        print_error(
+            f'Aggregator "{name}" not found.',
+            f"Available: {', '.join(aggregator_presets)}",
+        )
+        raise typer.Exit(1)
+    return aggregator_presets[name]()
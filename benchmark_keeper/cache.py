@@ -0,0 +1,158 @@
+"""Persistent cache of parsed reports, keyed by git blob id"""
+
+import sqlite3
+import time
+import zlib
+from typing import Dict, Iterable, List, Mapping, Optional
+
+from pydantic import ValidationError
+
+from benchmark_keeper import LOCAL_DIR, RUN_CACHE, Report, get_path
+from benchmark_keeper.models import schema_digest
+
+# SQLite limits the number of parameters per statement
+_CHUNK = 500
+
+# Bump when the stored representation changes to drop old entries.
+# Entries are also dropped when the fields of the models change (see schema_digest).
+_VERSION = 1
+
+# Resolved "<commit>:<path>" names kept at most. The oldest resolutions are dropped first.
+_MAX_BLOB_IDS = 200_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    oid TEXT PRIMARY KEY,
+    data BLOB,
+    size INTEGER NOT NULL,
+    last_used INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commit_blobs (
+    object_name TEXT PRIMARY KEY,
+    oid TEXT
+);
+CREATE INDEX IF NOT EXISTS reports_last_used ON reports (last_used);
+"""
+
+
+def _chunks(items: List[str]) -> Iterable[List[str]]:
+    for i in range(0, len(items), _CHUNK):
+        yield items[i : i + _CHUNK]
+
+
+class RunCache(object):
+    """
+    Reports stored in git blobs are immutable, so once parsed they are stored here.
+    A report that failed to parse is stored as None.
+    Least recently used reports are evicted when the cache grows over max_bytes,
+    the oldest blob resolutions when there are more than _MAX_BLOB_IDS.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        path = get_path().joinpath(LOCAL_DIR)
+        path.mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path.joinpath(RUN_CACHE), timeout=30)
+        (version,) = self.db.execute("PRAGMA user_version").fetchone()
+        # user_version is a signed 32 bit integer
+        expected = zlib.crc32(f"{_VERSION} {schema_digest(Report)}".encode()) >> 1
+        if version != expected:
+            self.db.executescript(
+                "DROP TABLE IF EXISTS reports; DROP TABLE IF EXISTS commit_blobs;"
+            )
+            self.db.execute(f"PRAGMA user_version = {expected}")
+        self.db.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.db.close()
+
+    def get_blob_ids(self, object_names: List[str]) -> Dict[str, Optional[str]]:
+        """Cached resolutions of "<commit>:<path>" names. Missing blobs map to None."""
+        found: Dict[str, Optional[str]] = {}
+        for chunk in _chunks(object_names):
+            rows = self.db.execute(
+                "SELECT object_name, oid FROM commit_blobs WHERE object_name IN "
+                f"({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            found.update(rows)
+        return found
+
+    def put_blob_ids(self, blob_ids: Mapping[str, Optional[str]]):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO commit_blobs VALUES (?, ?)", blob_ids.items()
+            )
+            # New rows get increasing rowids, so the oldest ones are at the bottom
+            self.db.execute(
+                "DELETE FROM commit_blobs WHERE rowid <= "
+                "(SELECT MAX(rowid) FROM commit_blobs) - ?",
+                (_MAX_BLOB_IDS,),
+            )
+
+    def get_reports(self, oids: Iterable[str]) -> Dict[str, Optional[Report]]:
+        oids = list(oids)
+        found: Dict[str, Optional[Report]] = {}
+        for chunk in _chunks(oids):
+            rows = self.db.execute(
+                f"SELECT oid, data FROM reports WHERE oid IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for oid, data in rows:
+                try:
+                    found[oid] = (
+                        None
+                        if data is None
+                        else Report.model_validate_json(zlib.decompress(data))
+                    )
+                except (ValidationError, zlib.error):
+                    # Written by an incompatible version. Will be parsed again.
+                    pass
+        if found:
+            now = time.time_ns()
+            with self.db:
+                self.db.executemany(
+                    "UPDATE reports SET last_used = ? WHERE oid = ?",
+                    ((now, oid) for oid in found),
+                )
+        return found
+
+    def put_reports(self, reports: Mapping[str, Optional[Report]]):
+        if not reports:
+            return
+        now = time.time_ns()
+        rows = []
+        for oid, report in reports.items():
+            data = (
+                None
+                if report is None
+                else zlib.compress(report.model_dump_json().encode())
+            )
+            rows.append((oid, data, len(data) if data else 0, now))
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?)", rows
+            )
+        self.evict()
+
+    def evict(self):
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM reports"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used reports until under the limit
+        excess = total - self.max_bytes
+        victims = []
+        for oid, size in self.db.execute(
+            "SELECT oid, size FROM reports ORDER BY last_used"
+        ):
+            if excess <= 0:
+                break
+            victims.append((oid,))
+            excess -= size
+        with self.db:
+            self.db.executemany("DELETE FROM reports WHERE oid = ?", victims)
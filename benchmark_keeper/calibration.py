@@ -0,0 +1,131 @@
+"""
+Rescaling of results measured on other machines, so runs of several machines can be ranked together.
+
+A run from another machine is multiplied by a factor that maps it to the local machine, either
+- the ratio of the local calibration result to the run's (Normalization.calibration), or
+- a per machine factor fitted from commits measured on several machines (Normalization.fit):
+  the median ratio of their common benchmarks, chained through machines without direct overlap.
+"""
+
+import math
+import pathlib
+import statistics
+import subprocess
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+import typer
+
+from benchmark_keeper import (
+    BenchmarkResult,
+    BenchmarkRun,
+    Experiment,
+    SampleStats,
+    Statistic,
+    TARGET_METRIC,
+    get_path,
+    print_error,
+)
+from benchmark_keeper.environment import pin_process, script_env
+from benchmark_keeper.formatting import ScriptDelimiter
+from benchmark_keeper.metrics import select_metric
+
+
+def run_calibration(
+    experiment: Experiment,
+    cpus: Optional[Set[int]] = None,
+    cwd: Optional[pathlib.Path] = None,
+) -> Optional[float]:
+    if (script := experiment.calibration_script) is None:
+        return None
+    with ScriptDelimiter(script):
+        proc = subprocess.Popen(
+            [(cwd or get_path()).joinpath(script)],
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            text=True,
+            env=script_env(experiment),
+        )
+        pin_process(proc.pid, experiment, cpus)
+        out, _ = proc.communicate()
+    try:
+        value = float(out.strip())
+    except ValueError:
+        value = 0.0
+    if proc.returncode != 0 or not value > 0:
+        print_error("Calibration failed", "Expected a positive number on stdout")
+        raise typer.Exit(1)
+    return value
+
+
+def scale_result(result: BenchmarkResult, factor: float) -> BenchmarkResult:
+    return result.model_copy(
+        update={
+            "target": result.target * factor,
+            "samples": [s * factor for s in result.samples],
+            "stats": (
+                SampleStats(
+                    **{k: v * factor for k, v in result.stats.model_dump().items()}
+                )
+                if result.stats is not None
+                else None
+            ),
+        }
+    )
+
+
+def scale_results(
+    benchmarks: Mapping[str, BenchmarkResult], factor: float
+) -> Mapping[str, BenchmarkResult]:
+    if factor == 1.0:
+        return benchmarks
+    return {name: scale_result(r, factor) for name, r in benchmarks.items()}
+
+
+def calibration_factor(
+    runs: Iterable[BenchmarkRun], machine: str
+) -> Callable[[BenchmarkRun], Optional[float]]:
+    """Factors relative to the median calibration of the given machine's runs"""
+    local = [r.calibration for r in runs if r.machine == machine and r.calibration]
+    if not local:
+        print_error(f"No calibrated run found for machine {machine}")
+        raise typer.Exit(1)
+    reference = statistics.median(local)
+    return lambda run: reference / run.calibration if run.calibration else None
+
+
+def fit_factors(
+    pairs: Iterable[Tuple[BenchmarkRun, BenchmarkRun]],
+    machine: str,
+    statistic: Statistic = Statistic.target,
+    metric: str = TARGET_METRIC,
+) -> Dict[str, float]:
+    """
+    Per machine factors to the given machine, from pairs of runs of the same commit
+    (fitted to the given metric of their results).
+    Machines that share no commit with a fitted machine get no factor.
+    """
+    # (machine a, machine b) -> log ratios of a's values to b's
+    logs: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+    for a, b in pairs:
+        if a.machine == b.machine:
+            continue
+        ma, mb = select_metric(a.benchmarks, metric), select_metric(
+            b.benchmarks, metric
+        )
+        for name in ma.keys() & mb.keys():
+            va = ma[name].statistic(statistic)
+            vb = mb[name].statistic(statistic)
+            if va > 0 and vb > 0:
+                logs[a.machine, b.machine].append(math.log(va / vb))
+                logs[b.machine, a.machine].append(math.log(vb / va))
+
+    factors = {machine: 1.0}
+    queue = [machine]
+    while queue:
+        m = queue.pop(0)
+        for (a, b), ratios in logs.items():
+            if a == m and b not in factors:
+                factors[b] = factors[m] * math.exp(statistics.median(ratios))
+                queue.append(b)
+    return factors
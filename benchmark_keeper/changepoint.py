@@ -0,0 +1,112 @@
+"""
+Detection of level shifts in a series of benchmark results.
+
+Binary segmentation: the split that most reduces the squared error of a segment is kept
+while its gain exceeds a penalty, then both halves are searched again.
+Every search is one linear scan over prefix sums (vectorized with NumPy, if installed),
+so a series of n runs with k shifts costs O(n log k).
+Values are scaled by a noise estimate first, so one penalty fits all benchmarks.
+"""
+
+import math
+import statistics
+from typing import Any, List, Tuple
+
+# Shorter segments are outliers rather than level shifts
+MIN_SEGMENT = 3
+
+# Scales the median absolute first difference of normal noise to its standard deviation
+_MAD_TO_SIGMA = 1 / (0.6744897501960817 * math.sqrt(2))
+
+
+def noise_sigma(values: List[float]) -> float:
+    """Noise level estimated from first differences, which level shifts barely affect"""
+    diffs = [abs(b - a) for a, b in zip(values, values[1:])]
+    sigma = statistics.median(diffs) * _MAD_TO_SIGMA if diffs else 0.0
+    # Noise free series: any shift at all is significant
+    return sigma or abs(statistics.fmean(values)) * 1e-9 or 1.0
+
+
+def _best_split_py(prefix: List[float], a: int, b: int) -> Tuple[int, float]:
+    total = prefix[b] - prefix[a]
+    base = total * total / (b - a)
+    best, best_gain = a, -math.inf
+    for s in range(a + MIN_SEGMENT, b - MIN_SEGMENT + 1):
+        left = prefix[s] - prefix[a]
+        right = total - left
+        gain = left * left / (s - a) + right * right / (b - s) - base
+        if gain > best_gain:
+            best, best_gain = s, gain
+    return best, best_gain
+
+
+def _best_split_np(np, prefix, a: int, b: int) -> Tuple[int, float]:
+    s = np.arange(a + MIN_SEGMENT, b - MIN_SEGMENT + 1)
+    left = prefix[s] - prefix[a]
+    right = prefix[b] - prefix[s]
+    total = prefix[b] - prefix[a]
+    gains = left * left / (s - a) + right * right / (b - s) - total * total / (b - a)
+    i = int(np.argmax(gains))
+    return int(s[i]), float(gains[i])
+
+
+def changepoints(values: List[float], penalty: float, np: Any = None) -> List[int]:
+    """
+    Indices i where a new level starts at values[i], in order.
+    penalty is the minimum reduction of the (noise scaled) squared error per shift.
+    """
+    n = len(values)
+    if n < 2 * MIN_SEGMENT:
+        return []
+    scale = 1 / noise_sigma(values)
+    mean = statistics.fmean(values)
+
+    if np is not None:
+        prefix = np.concatenate(
+            ([0.0], np.cumsum((np.asarray(values, dtype=float) - mean) * scale))
+        )
+        best_split = lambda a, b: _best_split_np(np, prefix, a, b)
+    else:
+        prefix = [0.0]
+        for v in values:
+            prefix.append(prefix[-1] + (v - mean) * scale)
+        best_split = lambda a, b: _best_split_py(prefix, a, b)
+
+    found = []
+    segments = [(0, n)]
+    while segments:
+        a, b = segments.pop()
+        if b - a < 2 * MIN_SEGMENT:
+            continue
+        s, gain = best_split(a, b)
+        if gain > penalty:
+            found.append(s)
+            segments += [(a, s), (s, b)]
+    return sorted(found)
+
+
+def level_shifts(
+    values: List[float], penalty: float, np: Any = None
+) -> List[Tuple[int, float, float]]:
+    """(index, mean before, mean after) of every shift, means taken over the adjacent segments"""
+    cps = changepoints(values, penalty, np)
+    bounds = [0, *cps, len(values)]
+    means = [statistics.fmean(values[a:b]) for a, b in zip(bounds, bounds[1:])]
+    return [(cp, means[i], means[i + 1]) for i, cp in enumerate(cps)]
+
+
+def default_penalty(n: int) -> float:
+    """BIC style penalty, growing with the length of the series"""
+    return 3 * math.log(max(n, 2))
+
+
+def load_numpy(n_values: int) -> Any:
+    """NumPy, if installed and the data is large enough to pay for its import time"""
+    if n_values < 100_000:
+        return None
+    try:
+        import numpy
+
+        return numpy
+    except ImportError:
+        return None
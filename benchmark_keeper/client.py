@@ -0,0 +1,75 @@
+"""
+Thin client of the serve daemon.
+
+Commands that the daemon answers (list, compare, trend) ask it first and only compute their
+results themselves if no daemon is running for the repository.
+Requests and responses are single JSON lines on the daemon's Unix socket.
+"""
+
+import json
+import os
+import sys
+from typing import Any, Mapping, Optional
+
+import typer
+
+from benchmark_keeper import LOCAL_DIR, SERVE_SOCKET, get_path
+
+# Bumped on incompatible changes, so an outdated daemon is bypassed instead of misread
+PROTOCOL = 4
+
+# Set to any value to never use the daemon
+NO_DAEMON_ENV = "BENCHK_NO_DAEMON"
+
+# Seconds to wait for the daemon to accept a connection and to answer.
+# A hung or busy daemon is bypassed after that.
+CONNECT_TIMEOUT = 1.0
+ANSWER_TIMEOUT = 10.0
+
+
+def socket_path():
+    return get_path().joinpath(LOCAL_DIR, SERVE_SOCKET)
+
+
+def query_daemon(command: str, args: Mapping[str, Any]) -> Optional[Any]:
+    """
+    Result of command computed by the daemon, or None if no daemon answers.
+    Output of the daemon (e.g. errors) is written to stdout, failures exit like the command would.
+    """
+    if os.environ.get(NO_DAEMON_ENV):
+        return None
+    path = socket_path()
+    if not path.exists():
+        return None
+
+    # Only needed with a daemon running (startup time)
+    import socket
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(str(path))
+            sock.settimeout(ANSWER_TIMEOUT)
+            sock.sendall(
+                json.dumps(
+                    {"version": PROTOCOL, "command": command, "args": args}
+                ).encode()
+                + b"\n"
+            )
+            with sock.makefile("rb") as f:
+                line = f.readline()
+    except OSError:
+        # Stale socket of a daemon that is gone, or a daemon that didn't answer in time
+        return None
+
+    try:
+        response = json.loads(line)
+    except ValueError:
+        return None
+    if response.get("version") != PROTOCOL:
+        return None
+
+    sys.stdout.write(response["output"])
+    if not response["ok"]:
+        raise typer.Exit(response["exit_code"])
+    return response["result"]
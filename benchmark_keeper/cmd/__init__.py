@@ -1,4 +1,68 @@
-from . import benchmark_cmd
-from . import init_cmd
-from . import switch_cmd
-from . import list_cmd
+"""
+Commands register themselves on the app when their module is imported.
+Only the module of the invoked command is imported, so startup doesn't grow with the number of commands.
+"""
+
+import importlib
+from typing import Optional
+
+from benchmark_keeper import app
+
+# Command name -> (module, summary shown by --help)
+COMMANDS = {
+    "benchmark": ("benchmark_cmd", "Runs and optionally commits benchmarks"),
+    "init": ("init_cmd", "Inits in current repository"),
+    "switch": ("switch_cmd", "Switch active experiment"),
+    "list": ("list_cmd", "Switch active experiment"),
+    "migrate": ("migrate_cmd", "Moves runs from report.yml to sharded storage"),
+    "check": (
+        "check_cmd",
+        "Classifies benchmarks of the current run against a baseline. Fails on regressions.",
+    ),
+    "bisect": (
+        "bisect_cmd",
+        "Finds the commit that introduced a regression, using stored runs where possible",
+    ),
+    "backfill": (
+        "backfill_cmd",
+        "Benchmarks past commits of the active experiment. Resumes where it stopped.",
+    ),
+    "profile-diff": (
+        "profile_cmd",
+        "Shows the functions whose self time changed most between the profiled runs of two commits",
+    ),
+    "trend": (
+        "trend_cmd",
+        "Finds commits where the level of a benchmark shifted, in commit order",
+    ),
+    "compare": ("compare_cmd", "Compares every benchmark of two runs"),
+    "serve": (
+        "serve_cmd",
+        "Keeps the history in memory and answers list, compare and trend of other calls",
+    ),
+    "watch": (
+        "watch_cmd",
+        "Benchmarks the working tree again whenever watched files change",
+    ),
+    "notes": ("notes_cmd", "Run storage in git notes"),
+}
+
+
+def load_commands(name: Optional[str] = None):
+    """Imports the module of command name, or of all commands"""
+    names = [name] if name in COMMANDS else list(COMMANDS)
+    for name in names:
+        importlib.import_module(f"{__name__}.{COMMANDS[name][0]}")
+
+
+def _summary_only():
+    pass
+
+
+def register_summaries():
+    """
+    Registers every command by its summary only. Enough to list the commands (--help),
+    without importing their modules and pydantic.
+    """
+    for name, (_, summary) in COMMANDS.items():
+        app.command(name=name, help=summary)(_summary_only)
@@ -0,0 +1,137 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Queue
+from threading import Semaphore
+from typing import Set
+
+import typer
+from pydantic import ValidationError
+
+from benchmark_keeper import (
+    BACKFILL_STATE,
+    LOCAL_DIR,
+    app,
+    console,
+    get_config,
+    get_path,
+    print_error,
+)
+from benchmark_keeper.cmd.benchmark_cmd import (
+    benchmark_commit,
+    pinned_slot,
+    serial_slot,
+    split_cpus,
+)
+from benchmark_keeper.git import range_commits
+from benchmark_keeper.report import get_own_runs
+from benchmark_keeper.worktree import WorktreePool
+
+
+def read_failed(key: str) -> Set[str]:
+    path = get_path().joinpath(LOCAL_DIR, BACKFILL_STATE)
+    if not path.exists():
+        return set()
+    return set(json.loads(path.read_text()).get(key, []))
+
+
+def write_failed(key: str, failed: Set[str]):
+    path = get_path().joinpath(LOCAL_DIR, BACKFILL_STATE)
+    state = json.loads(path.read_text()) if path.exists() else {}
+    state[key] = sorted(failed)
+    path.write_text(json.dumps(state))
+
+
+@app.command(name="backfill")
+def backfill(
+    revision_range: str = typer.Argument(help="Commits to benchmark, e.g. v1.0..HEAD"),
+    every: int = typer.Option(
+        1, "-k", "--every", min=1, help="Only benchmark every k-th commit"
+    ),
+    jobs: int = typer.Option(
+        1, "-j", "--jobs", min=1, help="Number of commits built and tested concurrently"
+    ),
+    bench_jobs: int = typer.Option(
+        1, "--bench-jobs", min=1, help="Number of commits benchmarked concurrently"
+    ),
+    pin: bool = typer.Option(
+        False, "--pin", help="Pin concurrent benchmarks to disjoint CPU sets"
+    ),
+    repeat: int = typer.Option(
+        1, "-n", "--repeat", min=1, help="Benchmark script runs per commit"
+    ),
+    retry_failed: bool = typer.Option(
+        False, "--retry-failed", help="Also retry commits that failed before"
+    ),
+) -> None:
+    """Benchmarks past commits of the active experiment. Resumes where it stopped."""
+
+    config = get_config()
+
+    if (experiment := config.active_experiment) is None:
+        print_error("No active experiment found")
+        raise typer.Exit(1)
+
+    commits = [commit for commit, _ in range_commits(revision_range)][::every]
+    # list only shows runs of this machine, so commits with runs of other machines (CI) aren't done
+    done = {
+        commit
+        for commit, run in get_own_runs(
+            commits, experiment.name, experiment.version
+        ).items()
+        if run.machine == config.local_config.machine_name
+    }
+    state_key = f"{experiment.name}@{experiment.version}"
+    failed = set() if retry_failed else read_failed(state_key)
+    todo = [c for c in commits if c not in done and c not in failed]
+
+    console.print(
+        f"{len(todo)} of {len(commits)} commits to benchmark "
+        f"({len(done)} done, {len(failed)} failed before)"
+    )
+    if not todo:
+        raise typer.Exit()
+
+    if pin:
+        cpu_sets: "Queue[Set[int]]" = Queue()
+        for cpus in split_cpus(bench_jobs):
+            cpu_sets.put(cpus)
+        bench_slot = lambda: pinned_slot(cpu_sets)
+    else:
+        semaphore = Semaphore(bench_jobs)
+        bench_slot = lambda: serial_slot(semaphore)
+
+    pool = WorktreePool(max(config.local_config.worktree_pool_size, jobs))
+    completed = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                benchmark_commit,
+                config,
+                experiment,
+                commit,
+                pool,
+                False,
+                repeat,
+                0,
+                bench_slot,
+            ): commit
+            for commit in todo
+        }
+        for future in as_completed(futures):
+            completed += 1
+            commit = futures[future]
+            try:
+                future.result()
+            except typer.Exit as e:
+                if e.exit_code != 0:
+                    failed.add(commit)
+                    write_failed(state_key, failed)
+            except (ValueError, ValidationError, RuntimeError) as e:
+                # Malformed benchmark output or a broken worktree only fail this commit
+                print_error(f"Benchmarking {commit[:10]} failed", str(e))
+                failed.add(commit)
+                write_failed(state_key, failed)
+            console.print(f"Backfill progress: {completed}/{len(todo)}")
+
+    if failed:
+        console.print(f"{len(failed)} commits failed. Rerun with --retry-failed.")
@@ -1,133 +1,418 @@
+import os
+import pathlib
+import signal
 import subprocess
-from typing import Any, Optional, Mapping
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import (
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Mapping,
+    Set,
+    Tuple,
+)
 
 from pydantic import ValidationError, TypeAdapter
 import typer
 import json
 from uuid import uuid4
-import hashlib
 
 from benchmark_keeper import (
     AppConfig,
     Color,
     Experiment,
+    OutputFormat,
     app,
     console,
     get_config,
     get_path,
     BenchmarkRun,
     BenchmarkResult,
+    ResourceUsage,
     print_error,
 )
 
+from benchmark_keeper.calibration import run_calibration
+from benchmark_keeper.digest import watch_digest
+from benchmark_keeper.environment import collect_fingerprint, pin_process, script_env
 from benchmark_keeper.formatting import ScriptDelimiter
-from benchmark_keeper.git import git_add_files
-from benchmark_keeper.report import add_run, get_current_run
+from benchmark_keeper.git import git_add_files, rev_parse
+from benchmark_keeper.labels import label_env, select_results
+from benchmark_keeper.profiles import (
+    PROFILE_ENV,
+    collect_profile,
+    profiled_command,
+    save_profile,
+)
+from benchmark_keeper.report import add_past_run, add_run, get_current_run
+from benchmark_keeper.resources import record as record_usage, wait_usage
+from benchmark_keeper.stats import summarize
+from benchmark_keeper.worktree import WorktreePool
+
+
+def run_script(
+    script: str,
+    phase: str,
+    cwd: Optional[pathlib.Path] = None,
+    resources: Optional[Dict[str, ResourceUsage]] = None,
+) -> int:
+    start = time.monotonic()
+    with ScriptDelimiter(script):
+        returncode, usage = wait_usage(subprocess.Popen([script], cwd=cwd), start)
+    record_usage(resources, phase, usage)
+    return returncode
 
 
-def run_build(experiment: Experiment):
+def run_build(
+    experiment: Experiment,
+    cwd: Optional[pathlib.Path] = None,
+    resources: Optional[Dict[str, ResourceUsage]] = None,
+):
     if (script := experiment.build_script) is None:
         console.print("No build script found. Skipping.")
     else:
-        with ScriptDelimiter(script):
-            r = subprocess.call([script])
+        r = run_script(script, "build", cwd, resources)
         if r != 0:
             print_error("Build failed")
             raise typer.Exit(1)
 
 
-def run_tests(experiment: Experiment):
+def run_tests(
+    experiment: Experiment,
+    cwd: Optional[pathlib.Path] = None,
+    resources: Optional[Dict[str, ResourceUsage]] = None,
+):
     if (script := experiment.test_script) is None:
         console.print("No test script found. Skipping.")
     else:
-        with ScriptDelimiter(script):
-            r = subprocess.call([script])
+        r = run_script(script, "test", cwd, resources)
         if r != 0:
             print_error("Tests failed")
             raise typer.Exit(1)
 
 
-def run_benchmarks(experiment: Experiment) -> Mapping[str, BenchmarkResult]:
+def kill_group(proc: subprocess.Popen):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _enqueue_lines(stream, lines: "Queue[Optional[str]]"):
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
+
+
+def stream_results(
+    experiment: Experiment, proc: subprocess.Popen
+) -> Tuple[Dict[str, BenchmarkResult], bool]:
+    """
+    Reads one result per line as the script emits it.
+    Returns the results and whether the script timed out (and was killed).
+    """
+    lines: "Queue[Optional[str]]" = Queue()
+    Thread(target=_enqueue_lines, args=(proc.stdout, lines), daemon=True).start()
+
+    deadline = (
+        time.monotonic() + experiment.suite_timeout
+        if experiment.suite_timeout is not None
+        else None
+    )
+    results: Dict[str, BenchmarkResult] = {}
+    while True:
+        timeouts = [
+            t
+            for t in (
+                experiment.benchmark_timeout,
+                deadline - time.monotonic() if deadline is not None else None,
+            )
+            if t is not None
+        ]
+        try:
+            line = lines.get(timeout=max(0, min(timeouts)) if timeouts else None)
+        except Empty:
+            kill_group(proc)
+            return results, True
+        if line is None:
+            return results, False
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            name = data.pop("name")
+            results[name] = BenchmarkResult(**data)
+        except (ValueError, KeyError, TypeError, AttributeError, ValidationError):
+            print_error("Ignoring bad benchmark output:", line.strip())
+            continue
+        console.print(f"[{Color.cyan}]{name}[/{Color.cyan}] {results[name].target}")
+
+
+def read_output(experiment: Experiment, proc: subprocess.Popen) -> Tuple[str, bool]:
+    """Reads the whole output. Returns it and whether the script timed out (and was killed)."""
+    chunks: List[str] = []
+    reader = Thread(target=lambda: chunks.append(proc.stdout.read()), daemon=True)  # type: ignore
+    reader.start()
+    reader.join(experiment.suite_timeout)
+    if reader.is_alive():
+        kill_group(proc)
+        return "", True
+    return "".join(chunks), False
+
+
+def run_benchmark_script(
+    experiment: Experiment,
+    cpus: Optional[Set[int]] = None,
+    cwd: Optional[pathlib.Path] = None,
+    resources: Optional[Dict[str, ResourceUsage]] = None,
+    profile_dir: Optional[pathlib.Path] = None,
+    env: Mapping[str, str] = {},
+) -> Tuple[Mapping[str, BenchmarkResult], bool]:
+    """Returns the results and whether they are complete"""
+    script = (cwd or get_path()).joinpath(experiment.benchmark_script)
+    start = time.monotonic()
     proc = subprocess.Popen(
-        [get_path().joinpath(experiment.benchmark_script)],
+        profiled_command(script, profile_dir) if profile_dir else [script],
+        cwd=cwd,
+        env=script_env(
+            experiment,
+            {**env, **({PROFILE_ENV: str(profile_dir)} if profile_dir else {})},
+        ),
         stdout=subprocess.PIPE,
         text=True,
+        start_new_session=True,
     )
+    pin_process(proc.pid, experiment, cpus)
     with ScriptDelimiter(experiment.benchmark_script):
-        out = proc.communicate()[0]
+        try:
+            if experiment.output_format == OutputFormat.jsonl:
+                results, timed_out = stream_results(experiment, proc)
+            else:
+                out, timed_out = read_output(experiment, proc)
+            returncode, usage = wait_usage(proc, start)
+        except BaseException:
+            # The script has its own session, so Ctrl-C only reaches us
+            kill_group(proc)
+            raise
+    record_usage(resources, "benchmark", usage)
+
+    if experiment.output_format == OutputFormat.jsonl:
+        if timed_out:
+            print_error("Benchmark timed out", f"after {len(results)} results")
+        elif returncode != 0:
+            print_error("Benchmark script failed", f"after {len(results)} results")
+        if not results:
+            print_error("Benchmark returned nothing")
+            raise typer.Exit(1)
+        return results, not timed_out and returncode == 0
+
+    if timed_out:
+        print_error("Benchmark timed out")
+        raise typer.Exit(1)
     if out == "":
         print_error("Benchmark returned nothing")
         raise typer.Exit(1)
 
-    return TypeAdapter(Mapping[str, BenchmarkResult]).validate_python(json.loads(out))
+    return (
+        TypeAdapter(Mapping[str, BenchmarkResult]).validate_python(json.loads(out)),
+        True,
+    )
 
 
-@app.command(name="benchmark")
-def benchmark(
-    dry: bool = typer.Option(
-        False, "-d", "--dry", help="If true benchmarks will be skipped"
-    ),
-    force_run: bool = typer.Option(
-        False,
-        "-f",
-        "--force",
-        help="Always run benchmarks, even if watched files haven't changed.",
-    ),
-) -> None:
-    """Runs and optionally commits benchmarks"""
+def merge_samples(
+    results: List[Mapping[str, BenchmarkResult]],
+) -> Mapping[str, BenchmarkResult]:
+    """
+    Combines repeated results of the same benchmarks. target (and every metric) becomes the median.
+    Labels and such are taken from the last repetition with the benchmark (the last one may be incomplete).
+    """
+    samples: Dict[str, List[float]] = {}
+    # (benchmark, metric) -> samples
+    metric_samples: Dict[Tuple[str, str], List[float]] = {}
+    last: Dict[str, BenchmarkResult] = {}
+    for result in results:
+        for name, bench in result.items():
+            last[name] = bench
+            samples.setdefault(name, []).extend(bench.samples or [bench.target])
+            for metric_name, metric in bench.metrics.items():
+                metric_samples.setdefault((name, metric_name), []).extend(
+                    metric.samples or [metric.value]
+                )
 
-    config = get_config()
+    merged = {}
+    for name, bench_samples in samples.items():
+        stats = summarize(bench_samples)
+        metrics = {}
+        for metric_name, metric in last[name].metrics.items():
+            m_samples = metric_samples[name, metric_name]
+            m_stats = summarize(m_samples)
+            metrics[metric_name] = metric.model_copy(
+                update={"value": m_stats.median, "samples": m_samples, "stats": m_stats}
+            )
+        merged[name] = last[name].model_copy(
+            update={
+                "target": stats.median,
+                "samples": bench_samples,
+                "stats": stats,
+                "metrics": metrics,
+            }
+        )
+    return merged
+
+
+def run_benchmarks(
+    experiment: Experiment,
+    repeat: int = 1,
+    warmup: int = 0,
+    cpus: Optional[Set[int]] = None,
+    cwd: Optional[pathlib.Path] = None,
+    resources: Optional[Dict[str, ResourceUsage]] = None,
+    env: Mapping[str, str] = {},
+) -> Tuple[Mapping[str, BenchmarkResult], bool]:
+    """Returns the results and whether they are complete"""
+    for i in range(warmup):
+        console.print(f"Warmup {i+1}/{warmup}")
+        run_benchmark_script(experiment, cpus, cwd, env=env)
+
+    if repeat <= 1:
+        return run_benchmark_script(experiment, cpus, cwd, resources, env=env)
+
+    results = []
+    for i in range(repeat):
+        console.print(f"Repetition {i+1}/{repeat}")
+        result, complete = run_benchmark_script(
+            experiment, cpus, cwd, resources, env=env
+        )
+        results.append(result)
+        if not complete:
+            break
+    return merge_samples(results), complete
 
-    if (experiment := config.active_experiment) is None:
-        print_error("No active experiment found")
-        raise typer.Exit(1)
 
+def run_profile(
+    experiment: Experiment,
+    tag: str,
+    cpus: Optional[Set[int]] = None,
+    cwd: Optional[pathlib.Path] = None,
+    env: Mapping[str, str] = {},
+):
+    """Extra run under the profiler, so the measured runs are not perturbed"""
+    console.print("Profiling")
+    with tempfile.TemporaryDirectory() as tmp:
+        run_benchmark_script(
+            experiment, cpus, cwd, profile_dir=pathlib.Path(tmp), env=env
+        )
+        stacks = collect_profile(pathlib.Path(tmp), experiment.benchmark_script)
+    if not stacks:
+        print_error(
+            "No profile collected.",
+            f"Use a Python benchmark script or write <benchmark>.folded files to ${PROFILE_ENV}",
+        )
+        return
+    save_profile(tag, stacks)
+
+
+@contextmanager
+def serial_slot(lock: ContextManager) -> Iterator[Optional[Set[int]]]:
+    """Benchmark phases run unpinned, as many at a time as lock admits"""
+    with lock:
+        yield None
+
+
+@contextmanager
+def pinned_slot(cpu_sets: "Queue[Set[int]]") -> Iterator[Optional[Set[int]]]:
+    """Benchmark phases run concurrently, each on its own CPU set"""
+    cpus = cpu_sets.get()
+    try:
+        yield cpus
+    finally:
+        cpu_sets.put(cpus)
+
+
+def split_cpus(n: int) -> List[Set[int]]:
+    """Splits the available CPUs into (at most) n disjoint sets"""
+    cpus = sorted(os.sched_getaffinity(0))
+    n = max(1, min(n, len(cpus)))
+    size = len(cpus) // n
+    return [set(cpus[i * size : (i + 1) * size]) for i in range(n)]
+
+
+def benchmark_experiment(
+    config: AppConfig,
+    experiment: Experiment,
+    dry: bool,
+    force_run: bool,
+    repeat: int,
+    warmup: int,
+    bench_slot: Callable[
+        [], ContextManager[Optional[Set[int]]]
+    ] = lambda: nullcontext(),
+    profile: bool = False,
+    labels: List[str] = [],
+    exclude_labels: List[str] = [],
+):
     console.print(f'Running benchmarks for "{experiment.name}"')
 
-    run_build(experiment)
+    env = label_env(labels, exclude_labels)
+    resources: Dict[str, ResourceUsage] = {}
+    run_build(experiment, resources=resources)
 
     # Compute hashes to check for changes
     file_digest = ""
     if experiment.watch_files:
         print("Watching")
-        h = hashlib.sha256(usedforsecurity=False)
-        for file in experiment.watch_files:
-            with open(get_path().joinpath(file), "rb") as f:
-                while True:
-                    data = f.read(65536)
-                    if not data:
-                        break
-                    h.update(data)
-        file_digest = h.hexdigest()
+        file_digest = watch_digest(experiment)
 
         current_run = get_current_run(experiment.name, experiment.version)
 
         if (
             not force_run
             and isinstance(current_run, BenchmarkRun)
+            and not current_run.incomplete
             and file_digest == current_run.file_digest
         ):
-            git_add_files()
             console.print(
                 "Skipping tests and benchmarks, since watched files are unchanged"
             )
-            raise typer.Exit()
+            return
 
-    run_tests(experiment)
+    run_tests(experiment, resources=resources)
 
     if dry:
         console.print("Skipping benchmarks (due to -d)")
-        raise typer.Exit()
+        return
 
-    b_result = run_benchmarks(experiment)
+    with bench_slot() as cpus:
+        fingerprint = collect_fingerprint()
+        calibration = run_calibration(experiment, cpus)
+        b_result, complete = run_benchmarks(
+            experiment, repeat, warmup, cpus, resources=resources, env=env
+        )
+        tag = uuid4().hex
+        if profile:
+            run_profile(experiment, tag, cpus, env=env)
+    b_result = select_results(b_result, labels, exclude_labels)
 
     try:
         run_output = BenchmarkRun(
-            tag=uuid4().hex,
+            tag=tag,
             experiment=experiment.name,
             experiment_version=experiment.version,
             machine=config.local_config.machine_name,
             benchmarks=b_result,
+            # A run of some labels only is not a complete run either
+            incomplete=not complete or bool(labels or exclude_labels),
+            resources=resources,
+            calibration=calibration,
+            fingerprint=fingerprint,
             file_digest=file_digest,
         )
         add_run(run_output)
@@ -135,4 +420,245 @@ def benchmark(
         print_error(f"Benchmark script output badly formatted")
         raise typer.Exit(1)
 
+
+def benchmark_commit(
+    config: AppConfig,
+    experiment: Experiment,
+    commit: str,
+    pool: WorktreePool,
+    dry: bool,
+    repeat: int,
+    warmup: int,
+    bench_slot: Callable[
+        [], ContextManager[Optional[Set[int]]]
+    ] = lambda: nullcontext(),
+    profile: bool = False,
+    labels: List[str] = [],
+    exclude_labels: List[str] = [],
+) -> Optional[BenchmarkRun]:
+    """Benchmarks a past commit in a worktree and records the run against it"""
+    console.print(f'Running benchmarks for "{experiment.name}" at {commit[:10]}')
+
+    env = label_env(labels, exclude_labels)
+
+    resources: Dict[str, ResourceUsage] = {}
+    with pool.checkout(commit) as (path, built):
+        if built:
+            console.print("Source tree already built. Skipping build.")
+        else:
+            run_build(experiment, path, resources)
+            pool.mark_built(path, commit)
+
+        run_tests(experiment, path, resources)
+
+        if dry:
+            console.print("Skipping benchmarks (due to -d)")
+            return None
+
+        with bench_slot() as cpus:
+            fingerprint = collect_fingerprint()
+            calibration = run_calibration(experiment, cpus, path)
+            b_result, complete = run_benchmarks(
+                experiment, repeat, warmup, cpus, path, resources, env
+            )
+            tag = uuid4().hex
+            if profile:
+                run_profile(experiment, tag, cpus, path, env)
+    b_result = select_results(b_result, labels, exclude_labels)
+
+    try:
+        run_output = BenchmarkRun(
+            tag=tag,
+            experiment=experiment.name,
+            experiment_version=experiment.version,
+            machine=config.local_config.machine_name,
+            benchmarks=b_result,
+            # A run of some labels only is not a complete run either
+            incomplete=not complete or bool(labels or exclude_labels),
+            resources=resources,
+            calibration=calibration,
+            fingerprint=fingerprint,
+        )
+    except ValidationError as e:
+        print_error(f"Benchmark script output badly formatted")
+        raise typer.Exit(1)
+    add_past_run(commit, run_output)
+    return run_output
+
+
+def select_experiments(
+    config: AppConfig, all_experiments: bool, experiments: Optional[str]
+) -> List[Experiment]:
+    if all_experiments:
+        return config.repo_config.experiments
+    if experiments:
+        by_name = {exp.name: exp for exp in config.repo_config.experiments}
+        selected = []
+        for name in experiments.split(","):
+            if name.strip() not in by_name:
+                print_error(f'Experiment "{name.strip()}" not found')
+                raise typer.Exit(1)
+            selected.append(by_name[name.strip()])
+        return selected
+    if (experiment := config.active_experiment) is None:
+        print_error("No active experiment found")
+        raise typer.Exit(1)
+    return [experiment]
+
+
+@app.command(name="benchmark")
+def benchmark(
+    dry: bool = typer.Option(
+        False, "-d", "--dry", help="If true benchmarks will be skipped"
+    ),
+    force_run: bool = typer.Option(
+        False,
+        "-f",
+        "--force",
+        help="Always run benchmarks, even if watched files haven't changed.",
+    ),
+    repeat: int = typer.Option(
+        1,
+        "-n",
+        "--repeat",
+        min=1,
+        help="Number of times to run the benchmark script. Samples and their statistics are stored.",
+    ),
+    warmup: int = typer.Option(
+        0,
+        "-w",
+        "--warmup",
+        min=0,
+        help="Number of discarded runs of the benchmark script before measuring",
+    ),
+    all_experiments: bool = typer.Option(
+        False, "--all", help="Run all experiments instead of the active one"
+    ),
+    experiments: str = typer.Option(
+        None,
+        "-e",
+        "--experiments",
+        help="Comma separated experiments to run instead of the active one",
+    ),
+    jobs: int = typer.Option(
+        1,
+        "-j",
+        "--jobs",
+        min=1,
+        help="Number of experiments built and tested concurrently",
+    ),
+    pin: bool = typer.Option(
+        False,
+        "--pin",
+        help="Run benchmarks concurrently on disjoint CPU sets instead of one at a time",
+    ),
+    commits: List[str] = typer.Option(
+        [],
+        "-c",
+        "--commit",
+        help="Benchmark a past commit in a worktree instead of the working tree (repeatable)",
+    ),
+    labels: List[str] = typer.Option(
+        [],
+        "-L",
+        "--label",
+        help="Only run benchmarks with this label (repeatable). Passed to the script as $BENCHK_LABELS.",
+    ),
+    exclude_labels: List[str] = typer.Option(
+        [],
+        "--exclude-label",
+        help="Skip benchmarks with this label (repeatable). Passed to the script as $BENCHK_EXCLUDE_LABELS.",
+    ),
+    profile: bool = typer.Option(
+        False,
+        "--profile",
+        help="Profile an extra run of the benchmark script, stored with the run (see profile-diff)",
+    ),
+) -> None:
+    """Runs and optionally commits benchmarks"""
+
+    config = get_config()
+
+    selected = select_experiments(config, all_experiments, experiments)
+
+    if commits:
+        resolved = []
+        for rev in commits:
+            if (commit := rev_parse(rev)) is None:
+                print_error(f'Revision "{rev}" not found')
+                raise typer.Exit(1)
+            resolved.append(commit)
+        pool = WorktreePool(config.local_config.worktree_pool_size)
+        for commit in resolved:
+            for experiment in selected:
+                benchmark_commit(
+                    config,
+                    experiment,
+                    commit,
+                    pool,
+                    dry,
+                    repeat,
+                    warmup,
+                    profile=profile,
+                    labels=labels,
+                    exclude_labels=exclude_labels,
+                )
+        return
+
+    failed = []
+    if len(selected) == 1 or jobs == 1:
+        for experiment in selected:
+            try:
+                benchmark_experiment(
+                    config,
+                    experiment,
+                    dry,
+                    force_run,
+                    repeat,
+                    warmup,
+                    profile=profile,
+                    labels=labels,
+                    exclude_labels=exclude_labels,
+                )
+            except typer.Exit as e:
+                if e.exit_code != 0:
+                    failed.append(experiment.name)
+    else:
+        if pin:
+            cpu_sets: "Queue[Set[int]]" = Queue()
+            for cpus in split_cpus(min(jobs, len(selected))):
+                cpu_sets.put(cpus)
+            bench_slot = lambda: pinned_slot(cpu_sets)
+        else:
+            lock = Lock()
+            bench_slot = lambda: serial_slot(lock)
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                pool.submit(
+                    benchmark_experiment,
+                    config,
+                    experiment,
+                    dry,
+                    force_run,
+                    repeat,
+                    warmup,
+                    bench_slot,
+                    profile,
+                    labels,
+                    exclude_labels,
+                ): experiment
+                for experiment in selected
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except typer.Exit as e:
+                    if e.exit_code != 0:
+                        failed.append(futures[future].name)
+
     git_add_files()
+
+    if failed:
+        print_error("Failed experiments:", ", ".join(failed))
+        raise typer.Exit(1)
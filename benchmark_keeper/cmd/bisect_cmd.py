@@ -0,0 +1,101 @@
+from typing import Optional
+
+import typer
+
+from benchmark_keeper import BenchmarkRun, Color, app, console, get_config, print_error
+from benchmark_keeper.cmd.benchmark_cmd import benchmark_commit
+from benchmark_keeper.git import commit_range
+from benchmark_keeper.report import get_own_runs
+from benchmark_keeper.stats import run_ratio
+from benchmark_keeper.worktree import WorktreePool
+
+
+@app.command(name="bisect")
+def bisect(
+    good: str = typer.Option(
+        ..., "-g", "--good", help="A commit without the regression"
+    ),
+    bad: str = typer.Option("HEAD", "-b", "--bad", help="A commit with the regression"),
+    benchmark: str = typer.Option(
+        None,
+        "--benchmark",
+        help="Benchmark to bisect. Defaults to the geometric mean over all benchmarks.",
+    ),
+    threshold: float = typer.Option(
+        5.0,
+        "-t",
+        "--threshold",
+        help="Slowdown relative to the good commit (in percent) that counts as regression",
+    ),
+    repeat: int = typer.Option(
+        1, "-n", "--repeat", min=1, help="Benchmark script runs per tested commit"
+    ),
+) -> None:
+    """Finds the commit that introduced a regression, using stored runs where possible"""
+
+    config = get_config()
+
+    if (experiment := config.active_experiment) is None:
+        print_error("No active experiment found")
+        raise typer.Exit(1)
+
+    commits = commit_range(good, bad)
+    hashes = [commit for commit, _ in commits]
+    # Only complete runs of this machine are comparable to the ones measured here
+    known = {
+        commit: run
+        for commit, run in get_own_runs(
+            hashes, experiment.name, experiment.version
+        ).items()
+        if run.machine == config.local_config.machine_name and not run.incomplete
+    }
+    pool = WorktreePool(config.local_config.worktree_pool_size)
+
+    def run_of(i: int) -> BenchmarkRun:
+        if hashes[i] not in known:
+            run = benchmark_commit(
+                config, experiment, hashes[i], pool, False, repeat, 0
+            )
+            assert run is not None
+            known[hashes[i]] = run
+        return known[hashes[i]]
+
+    base = run_of(0)
+
+    def is_bad(i: int) -> Optional[bool]:
+        ratio = run_ratio(base, known[hashes[i]], benchmark)
+        return None if ratio is None else ratio > 1 + threshold / 100
+
+    # Narrow the range with stored runs first
+    lo, hi = 0, len(hashes) - 1
+    verdicts = {i: is_bad(i) for i in range(len(hashes)) if hashes[i] in known}
+    hi = min((i for i, v in verdicts.items() if v), default=hi)
+    lo = max((i for i, v in verdicts.items() if v is False and i < hi), default=lo)
+
+    run_of(hi)
+    if not is_bad(hi):
+        print_error(f"{bad} is not slower than {good} by more than {threshold}%")
+        raise typer.Exit(1)
+
+    console.print(
+        f"{hi - lo - 1} untested commits left after using {len(known)} stored runs"
+    )
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        run_of(mid)
+        verdict = is_bad(mid)
+        if verdict is None:
+            print_error(f"Nothing to compare at {hashes[mid][:10]}")
+            raise typer.Exit(1)
+        console.print(f"{hashes[mid][:10]} is {'bad' if verdict else 'good'}")
+        if verdict:
+            hi = mid
+        else:
+            lo = mid
+
+    ratio = run_ratio(base, known[hashes[hi]], benchmark)
+    console.print(
+        f"[{Color.red}]First bad commit:[/{Color.red}] {hashes[hi][:10]} {commits[hi][1]} "
+        f"({(ratio or 1) - 1:+.2%} against {good})"
+    )
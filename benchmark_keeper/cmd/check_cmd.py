@@ -0,0 +1,59 @@
+import typer
+
+from benchmark_keeper import BenchmarkRun, Color, app, console, get_config, print_error
+from benchmark_keeper.formatting import print_changes
+from benchmark_keeper.git import rev_parse
+from benchmark_keeper.report import get_commit_run, get_current_run
+from benchmark_keeper.stats import Change, compare_runs
+
+
+def get_baseline_run(baseline: str, experiment: str, experiment_version: int):
+    if (commit := rev_parse(baseline)) is None:
+        print_error(f'Revision "{baseline}" not found')
+        raise typer.Exit(1)
+    run = get_commit_run(commit, experiment, experiment_version)
+    if not isinstance(run, BenchmarkRun):
+        print_error(f'No run found for "{experiment}" at {commit[:10]}')
+        raise typer.Exit(1)
+    return run
+
+
+@app.command(name="check")
+def check(
+    baseline: str = typer.Option(
+        "HEAD", "-b", "--baseline", help="Commit whose run is compared against"
+    ),
+    alpha: float = typer.Option(
+        0.05, "--alpha", help="Significance level for repeated samples"
+    ),
+    threshold: float = typer.Option(
+        1.0, "-t", "--threshold", help="Changes below this percentage are noise"
+    ),
+) -> None:
+    """Classifies benchmarks of the current run against a baseline. Fails on regressions."""
+
+    config = get_config()
+
+    if (experiment := config.active_experiment) is None:
+        print_error("No active experiment found")
+        raise typer.Exit(1)
+
+    current = get_current_run(experiment.name, experiment.version)
+    if not isinstance(current, BenchmarkRun):
+        print_error("No current run found")
+        raise typer.Exit(1)
+
+    base = get_baseline_run(baseline, experiment.name, experiment.version)
+    if base.tag == current.tag:
+        console.print(f"Current run is the run of {baseline}")
+        raise typer.Exit()
+    if base.machine != current.machine:
+        console.print(
+            f"[{Color.yellow}]Warning:[/{Color.yellow}] baseline was measured on {base.machine}"
+        )
+
+    changes = compare_runs(base, current, alpha, threshold / 100)
+    print_changes(changes)
+
+    if any(change == Change.slower for change, _ in changes.values()):
+        raise typer.Exit(1)
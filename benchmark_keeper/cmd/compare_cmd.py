@@ -0,0 +1,223 @@
+import heapq
+import json
+import sys
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+import typer
+
+from benchmark_keeper import BenchmarkRun, Color, app, console, get_config, print_error
+from benchmark_keeper.client import query_daemon
+from benchmark_keeper.cmd.list_cmd import get_commits
+from benchmark_keeper.git import rev_parse
+from benchmark_keeper.labels import select_run
+from benchmark_keeper.local_runs import get_local_runs
+from benchmark_keeper.report import get_commit_run, get_current_run, get_history
+from benchmark_keeper.stats import Change, classify, relative_change, run_ratio
+
+CURRENT = "current"
+
+
+def resolve_run(spec: str, experiment: str, experiment_version: int) -> BenchmarkRun:
+    """spec is "current", a revision or a run tag"""
+    if spec == CURRENT:
+        run = get_current_run(experiment, experiment_version)
+        if not isinstance(run, BenchmarkRun):
+            print_error("No current run found")
+            raise typer.Exit(1)
+        return run
+
+    if (commit := rev_parse(spec)) is not None:
+        run = get_commit_run(commit, experiment, experiment_version)
+        if not isinstance(run, BenchmarkRun):
+            print_error(f'No run found for "{experiment}" at {commit[:10]}')
+            raise typer.Exit(1)
+        return run
+
+    current = get_current_run(experiment, experiment_version)
+    candidates = [current] if isinstance(current, BenchmarkRun) else []
+    candidates += get_local_runs(experiment, experiment_version).values()
+    history = get_history(
+        [commit for commit, _ in get_commits()], experiment, experiment_version
+    )
+    candidates += [run for run in history.values() if isinstance(run, BenchmarkRun)]
+    for run in candidates:
+        if run.tag.startswith(spec):
+            return run
+    print_error(f'"{spec}" is neither a revision nor a run tag of "{experiment}"')
+    raise typer.Exit(1)
+
+
+def compare_data(
+    base_spec: str,
+    new_spec: str,
+    top: int = 10,
+    alpha: float = 0.05,
+    threshold: float = 1.0,
+    labels: List[str] = [],
+    exclude_labels: List[str] = [],
+) -> Dict[str, Any]:
+    """Comparison of two runs as printed by compare --json (see compare for the parameters)"""
+
+    config = get_config()
+
+    if (experiment := config.active_experiment) is None:
+        print_error("No active experiment found")
+        raise typer.Exit(1)
+
+    base = select_run(
+        resolve_run(base_spec, experiment.name, experiment.version),
+        labels,
+        exclude_labels,
+    )
+    new = select_run(
+        resolve_run(new_spec, experiment.name, experiment.version),
+        labels,
+        exclude_labels,
+    )
+
+    common = new.benchmarks.keys() & base.benchmarks.keys()
+    added = sorted(new.benchmarks.keys() - base.benchmarks.keys())
+    removed = sorted(base.benchmarks.keys() - new.benchmarks.keys())
+
+    # name -> (change, relative change)
+    changes: Dict[str, Tuple[Change, float]] = {}
+    for name in sorted(common):
+        b, n = base.benchmarks[name], new.benchmarks[name]
+        changes[name] = (
+            classify(b, n, alpha, threshold / 100),
+            relative_change(b, n),
+        )
+
+    significant = [
+        (name, rel) for name, (change, rel) in changes.items() if change != Change.noise
+    ]
+    regressions = heapq.nlargest(
+        top, ((n, r) for n, r in significant if r > 0), key=lambda x: x[1]
+    )
+    improvements = heapq.nsmallest(
+        top, ((n, r) for n, r in significant if r < 0), key=lambda x: x[1]
+    )
+    counts = Counter(change for change, _ in changes.values())
+
+    return {
+        "base": {"tag": base.tag, "machine": base.machine},
+        "new": {"tag": new.tag, "machine": new.machine},
+        "env_mismatches": (
+            base.fingerprint.mismatches(new.fingerprint)
+            if base.fingerprint is not None and new.fingerprint is not None
+            else []
+        ),
+        "geomean_ratio": run_ratio(base, new),
+        "counts": {change.value: counts[change] for change in Change},
+        "added": added,
+        "removed": removed,
+        "regressions": [name for name, _ in regressions],
+        "improvements": [name for name, _ in improvements],
+        "benchmarks": {
+            name: {
+                "base": base.benchmarks[name].target,
+                "new": new.benchmarks[name].target,
+                "change": change.value,
+                "relative_change": rel,
+            }
+            for name, (change, rel) in sorted(changes.items())
+        },
+    }
+
+
+def print_compare(data: Dict[str, Any], base_spec: str, new_spec: str, top: int):
+    base, new, benchmarks = data["base"], data["new"], data["benchmarks"]
+    added, removed, counts = data["added"], data["removed"], data["counts"]
+
+    console.print(
+        f"{base_spec} ({base['tag'][:10]}, {base['machine']}) -> {new_spec} ({new['tag'][:10]}, {new['machine']})"
+    )
+    if base["machine"] != new["machine"]:
+        console.print(
+            f"[{Color.yellow}]Warning:[/{Color.yellow}] runs were measured on different machines"
+        )
+    elif fields := data["env_mismatches"]:
+        console.print(
+            f"[{Color.yellow}]Warning:[/{Color.yellow}] runs were measured in different environments ({', '.join(fields)})"
+        )
+    console.print(
+        f"{len(benchmarks)} common benchmarks, {len(added)} added, {len(removed)} removed"
+    )
+    if (ratio := data["geomean_ratio"]) is not None:
+        console.print(f"Geometric mean ratio: {ratio:.4f} ({1 / ratio:.4f}x speedup)")
+
+    def print_top(title: str, names: List[str], color: Color):
+        if not names:
+            return
+        console.print(f"\n{title}:")
+        for name in names:
+            b = benchmarks[name]
+            console.print(
+                f"[{color}]{b['relative_change']:+8.2%}[/{color}] {name}: "
+                f"{b['base']:.4g} -> {b['new']:.4g}"
+            )
+
+    print_top("Regressions", data["regressions"], Color.red)
+    print_top("Improvements", data["improvements"], Color.green)
+    for title, names in (("Added", added), ("Removed", removed)):
+        if names:
+            more = f" ... and {len(names) - top} more" if len(names) > top else ""
+            console.print(f"\n{title}: {', '.join(names[:top])}{more}")
+
+    console.print(
+        f"\n{counts[Change.slower.value]} slower, {counts[Change.faster.value]} faster, "
+        f"{counts[Change.noise.value]} within noise"
+    )
+
+
+@app.command(name="compare")
+def compare(
+    base_spec: str = typer.Argument(
+        ..., metavar="A", help='Base run: "current", a revision or a run tag'
+    ),
+    new_spec: str = typer.Argument(
+        ..., metavar="B", help='Compared run: "current", a revision or a run tag'
+    ),
+    top: int = typer.Option(
+        10, "-n", "--top", min=0, help="Number of regressions and improvements to show"
+    ),
+    alpha: float = typer.Option(
+        0.05, "--alpha", help="Significance level for repeated samples"
+    ),
+    threshold: float = typer.Option(
+        1.0, "-t", "--threshold", help="Changes below this percentage are noise"
+    ),
+    labels: List[str] = typer.Option(
+        [],
+        "-L",
+        "--label",
+        help="Only benchmarks with this label (repeatable, any of them)",
+    ),
+    exclude_labels: List[str] = typer.Option(
+        [],
+        "--exclude-label",
+        help="Leave out benchmarks with this label (repeatable)",
+    ),
+    as_json: bool = typer.Option(
+        False, "--json", help="Print all benchmarks and the summary as JSON"
+    ),
+) -> None:
+    """Compares every benchmark of two runs"""
+    params = dict(
+        base_spec=base_spec,
+        new_spec=new_spec,
+        top=top,
+        alpha=alpha,
+        threshold=threshold,
+        labels=labels,
+        exclude_labels=exclude_labels,
+    )
+    if (data := query_daemon("compare", params)) is None:
+        data = compare_data(**params)
+
+    if as_json:
+        json.dump(data, sys.stdout)
+        sys.stdout.write("\n")
+        return
+    print_compare(data, base_spec, new_spec, top)
@@ -1,20 +1,38 @@
+import heapq
 import subprocess
+from contextlib import closing
+from itertools import islice
 from subprocess import PIPE, Popen
-from typing import Any, List, Mapping, Tuple
+from typing import Any, Collection, Dict, Iterator, List, Mapping, Optional, Tuple
 
 import typer
 from pydantic.dataclasses import dataclass
 
-from benchmark_keeper import BenchmarkRun, app, console, get_config, Color
-from benchmark_keeper.report import get_commit_run, get_current_run
-from benchmark_keeper.aggregator import aggregator_presets, DEFAULT_AGGREGATOR
+from benchmark_keeper import (
+    BenchmarkRun,
+    Normalization,
+    Statistic,
+    TARGET_METRIC,
+    app,
+    console,
+    get_config,
+    print_error,
+    Color,
+)
+from benchmark_keeper.report import get_history, get_current_run, get_machine_pairs
+from benchmark_keeper.aggregator import aggregator_presets, get_aggregator
+from benchmark_keeper.git import rev_parse
+from benchmark_keeper.metrics import metric_kind, metric_names, select_metric
 
 fail_counter = 0
 
 
-def get_commits() -> List[Tuple[str, str]]:
+def _log_commits(*args: str) -> List[Tuple[str, str]]:
     proc = Popen(
-        ["git", "log", "--pretty=format:%H %s"], stdout=PIPE, stderr=PIPE, text=True
+        ["git", "log", "--pretty=format:%H %s", *args],
+        stdout=PIPE,
+        stderr=PIPE,
+        text=True,
     )
     o, e = proc.communicate()
     if e:
@@ -22,11 +40,56 @@ def get_commits() -> List[Tuple[str, str]]:
     return list(
         map(
             lambda x: (x.split(" ")[0], " ".join(x.split(" ")[1:])),
-            o.strip().split("\n"),
+            filter(None, o.strip().split("\n")),
         )
     )
 
 
+def iter_commits(*args: str) -> Iterator[Tuple[str, str]]:
+    """
+    (hash, subject) of commits newest first, read from git log as they are needed.
+    Closing the iterator early stops git log.
+    """
+    proc = Popen(
+        ["git", "log", "--pretty=format:%H %s", *args],
+        stdout=PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    try:
+        for line in proc.stdout:  # type: ignore
+            if line := line.rstrip("\n"):
+                commit, _, subject = line.partition(" ")
+                yield commit, subject
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+# HEAD and commits of the last call, so long running processes (serve) only log new commits
+_commits: Optional[Tuple[str, List[Tuple[str, str]]]] = None
+
+
+def get_commits() -> List[Tuple[str, str]]:
+    global _commits
+    if _commits is not None:
+        old_head, old_commits = _commits
+        head = rev_parse("HEAD")
+        if head == old_head:
+            return old_commits
+        if (
+            head is not None
+            and subprocess.call(["git", "merge-base", "--is-ancestor", old_head, head])
+            == 0
+        ):
+            commits = _log_commits(f"{old_head}..{head}") + old_commits
+            _commits = (head, commits)
+            return commits
+    commits = _log_commits()
+    _commits = (commits[0][0], commits) if commits else None
+    return commits
+
+
 @dataclass
 class CommitData:
     commit_hash: str
@@ -46,28 +109,141 @@ def reducer(benchmark_results: Mapping[str, Mapping[str, Any]], metric: str) ->
     )
 
 
-@app.command(name="list")
-def list_cmd(
-    limit: int = typer.Option(
-        None,
-        "-l",
-        "--limit",
-        help="Limit number of commits to show",
-    ),
-    aggregator: str = typer.Option(
-        None,
-        "-a",
-        "--aggregator",
-        help="How to aggregate results of different benchmarks",
-    ),
-    commit_order: bool = typer.Option(
-        False,
-        "-c",
-        "--commit-order",
-        help="Sort results by commit order. If false, results will be shown in score order (default: false)",
-    ),
-) -> None:
-    """Switch active experiment"""
+def rank_rows(
+    annotated_data: List[AnnotatedCommitData],
+    current_tag: str,
+    lower_is_better: bool,
+    commit_order: bool,
+    limit: Optional[int],
+    other_env: Collection[str] = (),
+) -> List[Dict[str, Any]]:
+    """Runs (in commit order) by score, best last. other_env are tags of runs measured in another environment."""
+    if limit is None:
+        if not commit_order:
+            annotated_data.sort(key=lambda x: x.score, reverse=lower_is_better)
+    else:
+        current_annotated_run = None
+        for an in annotated_data:
+            if an.data.data.tag == current_tag:
+                current_annotated_run = an
+                break
+
+        if commit_order:
+            annotated_data = annotated_data[-limit:]
+        else:
+            # Only the best runs are sorted
+            best = heapq.nsmallest if lower_is_better else heapq.nlargest
+            annotated_data = sorted(
+                best(limit, annotated_data, key=lambda x: x.score),
+                key=lambda x: x.score,
+                reverse=lower_is_better,
+            )
+
+        # Include current run regardless of limit
+        if (
+            current_annotated_run is not None
+            and current_annotated_run not in annotated_data
+        ):
+            annotated_data.insert(0, current_annotated_run)
+
+    return [
+        {
+            "commit": cd.data.commit_hash,
+            "subject": cd.data.subject,
+            "tag": cd.data.data.tag,
+            "machine": cd.data.data.machine,
+            "score": cd.score,
+            "incomplete": cd.data.data.incomplete,
+            "current": cd.data.data.tag == current_tag,
+            "other_env": cd.data.data.tag in other_env,
+        }
+        for cd in annotated_data
+    ]
+
+
+def print_ranking(rows: List[Dict[str, Any]], unit: str, machine: str):
+    for i, row in enumerate(rows):
+        best_str = (
+            f" [{Color.yellow}](best)[/{Color.yellow}]" if i == len(rows) - 1 else ""
+        )
+        incomplete_str = (
+            f" [{Color.red}](incomplete)[/{Color.red}]" if row["incomplete"] else ""
+        )
+        machine_str = (
+            f" [{Color.magenta}]({row['machine']})[/{Color.magenta}]"
+            if row["machine"] != machine
+            else ""
+        )
+        current_str = (
+            f" [{Color.yellow}](current)[/{Color.yellow}]" if row["current"] else ""
+        )
+        env_str = (
+            f" [{Color.magenta}](other env)[/{Color.magenta}]"
+            if row["other_env"]
+            else ""
+        )
+        console.print(
+            f"{row['score']:012.2f} \[{unit}], {row['commit'][:10]}, {row['subject']}{best_str}{current_str}{machine_str}{env_str}{incomplete_str}"
+        )
+
+
+def print_list(data: Dict[str, Any]):
+    console.print(f"Comparing results for machine: {data['machine']}\n")
+
+    if not any(data["rankings"].values()):
+        console.print(
+            f"No results found for experiment {data['experiment']} on machine {data['machine']}"
+        )
+        return
+
+    if env := data["env"]:
+        console.print(
+            f"[{Color.yellow}]Warning:[/{Color.yellow}] {env['runs']} runs of this machine were measured in another environment "
+            f"({', '.join(env['fields'])})"
+            + (
+                ", left out\n"
+                if env["left_out"]
+                else ", marked (other env). Use --same-env to leave them out.\n"
+            )
+        )
+
+    for label, rows in data["rankings"].items():
+        if label:
+            console.print(f"\nLabel [{Color.cyan}]{label}[/{Color.cyan}]:")
+        print_ranking(rows, data["unit"], data["machine"])
+
+    if data["changes"] is not None:
+        from benchmark_keeper.formatting import print_changes
+        from benchmark_keeper.stats import Change
+
+        console.print(f"\nCurrent run against {data['baseline']}:")
+        print_changes(
+            {
+                name: (Change(change), rel)
+                for name, (change, rel) in data["changes"].items()
+            }
+        )
+
+
+def list_data(
+    limit: Optional[int] = None,
+    max_commits: Optional[int] = None,
+    since: Optional[str] = None,
+    aggregator: Optional[str] = None,
+    statistic: str = Statistic.target,
+    metric: str = TARGET_METRIC,
+    resource: Optional[str] = None,
+    normalize: Optional[str] = None,
+    labels: List[str] = [],
+    exclude_labels: List[str] = [],
+    by_label: bool = False,
+    baseline: Optional[str] = None,
+    commit_order: bool = False,
+    same_env: bool = False,
+) -> Dict[str, Any]:
+    """Rankings of runs as printed by list (see list_cmd for the parameters)"""
+    from benchmark_keeper.labels import label_index, select, select_run
+
     global fail_counter
 
     fail_counter = 0
@@ -78,85 +254,345 @@ def list_cmd(
     if experiment is None:
         raise RuntimeError("Experiment missing")
 
-    console.print(
-        f"Comparing results for machine: {config.local_config.machine_name}\n"
-    )
+    statistic = Statistic(statistic)
+    normalize = Normalization(normalize) if normalize is not None else None
 
-    commit_data: List[CommitData] = []
-    for commit in get_commits():
-        res = get_commit_run(commit[0], experiment.name, experiment.version)
-        if isinstance(res, BenchmarkRun):
-            commit_data.append(
-                CommitData(commit_hash=commit[0], subject=commit[1], data=res)
-            )
-        # Ignore failures for now
+    # Get aggregator
+    _agg = get_aggregator(aggregator)
+    _agg.statistic = statistic
+    if resource is not None:
+        if metric != TARGET_METRIC:
+            print_error("--metric and --resource exclude each other")
+            raise typer.Exit(1)
+        from benchmark_keeper.resources import parse_resource, resource_results
+
+        phase, field = parse_resource(resource)
+        _agg = aggregator_presets["mean"]()
 
     current_data = get_current_run(experiment.name, experiment.version)
     current_tag = ""
     if isinstance(current_data, BenchmarkRun):
-        commit_data.insert(
-            0, CommitData(commit_hash="0" * 40, subject="Current", data=current_data)
-        )
         current_tag = current_data.tag
 
-    # Commit data is sorted by commit order
-    # Remove duplicate tags
-    seen = set()
+    machine = config.local_config.machine_name
 
-    commit_data = [
-        cd
-        for cd in commit_data[::-1]
-        if (
-            cd.data.machine == config.local_config.machine_name
-            and cd.data.tag not in seen
-            and not seen.add(cd.data.tag)
+    def rank(
+        commits: List[Tuple[str, str]],
+    ) -> Tuple[List[CommitData], Dict[str, Dict[int, float]], Dict[str, List[str]]]:
+        """
+        Runs of the given commits (oldest first), their scores and the differing fingerprint fields
+        of runs of this machine measured in another environment than the newest one (by tag)
+        """
+        commit_runs = get_history(
+            [commit[0] for commit in commits], experiment.name, experiment.version
         )
-    ]
 
-    # Get aggregator
-    _agg = aggregator_presets[aggregator if aggregator else DEFAULT_AGGREGATOR]()
-    aggregated = _agg.aggregate([cd.data.benchmarks for cd in commit_data])
+        commit_data: List[CommitData] = []
+        for commit in commits:
+            res = commit_runs[commit[0]]
+            if isinstance(res, BenchmarkRun):
+                commit_data.append(
+                    CommitData(commit_hash=commit[0], subject=commit[1], data=res)
+                )
+            # Ignore failures for now
 
-    annotated_data: List[AnnotatedCommitData] = []
-    for i, cd in enumerate(commit_data):
-        annotated_data.append(AnnotatedCommitData(data=cd, score=aggregated[i]))
+        if isinstance(current_data, BenchmarkRun):
+            commit_data.insert(
+                0,
+                CommitData(commit_hash="0" * 40, subject="Current", data=current_data),
+            )
 
-    if not commit_order:
-        annotated_data.sort(key=lambda x: x.score, reverse=_agg.lower_is_better())
+        # Commit data is sorted by commit order
+        # Remove duplicate tags
+        seen = set()
 
-    if limit is not None:
-        current_annotated_run = None
-        for an in annotated_data:
-            if an.data.data.tag == current_tag:
-                current_annotated_run = an
+        commit_data = [
+            cd
+            for cd in commit_data[::-1]
+            if (
+                (normalize is not None or cd.data.machine == machine)
+                and cd.data.tag not in seen
+                and not seen.add(cd.data.tag)
+            )
+        ]
+
+        fingerprints = [
+            cd.data.fingerprint
+            for cd in commit_data[::-1]
+            if cd.data.machine == machine and cd.data.fingerprint is not None
+        ]
+        other_env = {
+            cd.data.tag: fields
+            for cd in commit_data
+            if cd.data.machine == machine
+            and cd.data.fingerprint is not None
+            and (fields := fingerprints[0].mismatches(cd.data.fingerprint))
+        }
+        if same_env:
+            commit_data = [cd for cd in commit_data if cd.data.tag not in other_env]
+
+        # Results of the selected metric, rescaled to this machine
+        benchmarks = [select_metric(cd.data.benchmarks, metric) for cd in commit_data]
+        if normalize is not None:
+            # Imported on demand, like everything list doesn't need by default (startup time)
+            from benchmark_keeper.calibration import (
+                calibration_factor,
+                fit_factors,
+                scale_results,
+            )
+
+            if normalize == Normalization.calibration:
+                calibrated = calibration_factor(
+                    [cd.data for cd in commit_data], machine
+                )
+                # Calibration measures time, rates like throughput scale inversely.
+                # Selected results have the metric as their target, so its kind is read from the raw ones
+                kind = metric_kind([cd.data.benchmarks for cd in commit_data], metric)
+                if kind is not None and not kind[1]:
+                    factor_of = lambda run: (f := calibrated(run)) and 1 / f
+                else:
+                    factor_of = calibrated
+            else:
+                factors = fit_factors(
+                    get_machine_pairs(
+                        [commit[0] for commit in commits],
+                        experiment.name,
+                        experiment.version,
+                    ),
+                    machine,
+                    statistic,
+                    metric,
+                )
+                factor_of = lambda run: factors.get(run.machine)
+            run_factors = [factor_of(cd.data) for cd in commit_data]
+            if dropped := run_factors.count(None):
+                console.print(f"Leaving out {dropped} runs without a factor\n")
+            benchmarks = [
+                scale_results(b, f) for b, f in zip(benchmarks, run_factors) if f
+            ]
+            commit_data = [cd for cd, f in zip(commit_data, run_factors) if f]
+
+        # Only selected benchmarks
+        benchmarks = [
+            select(cd.data, labels, exclude_labels, b)
+            for cd, b in zip(commit_data, benchmarks)
+        ]
+
+        if resource is not None:
+            results = [resource_results(cd.data, phase, field) for cd in commit_data]
+            rankings = {
+                "": {
+                    i: score
+                    for i, score in zip(
+                        [i for i, r in enumerate(results) if r is not None],
+                        _agg.aggregate([r for r in results if r is not None]),
+                    )
+                }
+            }
+        elif by_label:
+            rankings = _agg.aggregate_groups(
+                benchmarks, [label_index(cd.data) for cd in commit_data]
+            )
+        else:
+            ranked = [i for i, b in enumerate(benchmarks) if b]
+            rankings = {
+                "": dict(zip(ranked, _agg.aggregate([benchmarks[i] for i in ranked])))
+            }
+        return commit_data, rankings, other_env
+
+    log_args = [
+        *(["-n", str(max_commits)] if max_commits is not None else []),
+        *([f"--since={since}"] if since is not None else []),
+    ]
+    # The newest runs in commit order don't depend on older runs if scores are independent,
+    # so history is read in growing windows until more runs than shown are found.
+    # Loaded runs are kept (see get_commit_runs), so every window costs only its new commits.
+    stop_early = (
+        commit_order and limit is not None and normalize is None and _agg.independent
+    )
+    commits: List[Tuple[str, str]] = []
+    window = 64
+    with closing(iter_commits(*log_args)) as log:
+        while True:
+            chunk = list(islice(log, window if stop_early else None))
+            commits += chunk
+            commit_data, rankings, other_env = rank(commits)
+            if (
+                not stop_early
+                or len(chunk) < window
+                or rankings
+                and all(len(scores) > limit for scores in rankings.values())  # type: ignore
+            ):
                 break
+            window *= 2
 
-        annotated_data = annotated_data[-limit:]
+    if metric != TARGET_METRIC:
+        runs = [cd.data.benchmarks for cd in commit_data]
+        if (kind := metric_kind(runs, metric)) is None:
+            if commit_data:
+                print_error(
+                    f'No results of metric "{metric}" found',
+                    f"Available: {', '.join(metric_names(runs))}",
+                )
+                raise typer.Exit(1)
+        else:
+            _agg.metric_unit, _agg.metric_lower_is_better = kind
 
-        # Include current run regardless of limit
-        if (
-            current_annotated_run is not None
-            and current_annotated_run not in annotated_data
-        ):
-            annotated_data.insert(0, current_annotated_run)
+    unit = field if resource is not None else _agg.unit()
 
-    if not annotated_data:
-        console.print(
-            f"No results found for experiment {experiment.name} on machine {config.local_config.machine_name}"
+    def metric_run(run: BenchmarkRun) -> BenchmarkRun:
+        run = select_run(run, labels, exclude_labels)
+        return run.model_copy(
+            update={"benchmarks": select_metric(run.benchmarks, metric)}
         )
-        raise typer.Exit(0)
 
-    for i, cd in enumerate(annotated_data):
-        best_str = (
-            f" [{Color.yellow}](best)[/{Color.yellow}]"
-            if i == len(annotated_data) - 1
-            else ""
-        )
-        current_str = (
-            f" [{Color.yellow}](current)[/{Color.yellow}]"
-            if cd.data.data.tag == current_tag
-            else ""
-        )
-        console.print(
-            f"{cd.score:012.2f} \[{_agg.unit()}], {cd.data.commit_hash[:10]}, {cd.data.subject}{best_str}{current_str}"
-        )
+    changes = None
+    if baseline is not None and isinstance(current_data, BenchmarkRun):
+        from benchmark_keeper.cmd.check_cmd import get_baseline_run
+        from benchmark_keeper.stats import compare_runs
+
+        base = get_baseline_run(baseline, experiment.name, experiment.version)
+        changes = {
+            name: (change.value, rel)
+            for name, (change, rel) in compare_runs(
+                metric_run(base),
+                metric_run(current_data),
+                lower_is_better=_agg.metric_lower_is_better,
+            ).items()
+        }
+
+    return {
+        "machine": machine,
+        "experiment": experiment.name,
+        "unit": unit,
+        "rankings": {
+            label: rank_rows(
+                [
+                    AnnotatedCommitData(data=commit_data[i], score=score)
+                    for i, score in scores.items()
+                ],
+                current_tag,
+                _agg.lower_is_better(),
+                commit_order,
+                limit,
+                other_env,
+            )
+            for label, scores in rankings.items()
+        },
+        "env": (
+            {
+                "runs": len(other_env),
+                "fields": sorted(set().union(*other_env.values())),
+                "left_out": same_env,
+            }
+            if other_env
+            else None
+        ),
+        "baseline": baseline,
+        "changes": changes,
+    }
+
+
+@app.command(name="list")
+def list_cmd(
+    limit: int = typer.Option(
+        None,
+        "-l",
+        "--limit",
+        help="Limit number of commits to show",
+    ),
+    max_commits: int = typer.Option(
+        None,
+        "--max-commits",
+        min=1,
+        help="Only read the runs of this many of the newest commits",
+    ),
+    since: str = typer.Option(
+        None,
+        "--since",
+        help="Only read the runs of commits newer than this date, e.g. 2024-01-01 or '2 weeks ago'",
+    ),
+    aggregator: str = typer.Option(
+        None,
+        "-a",
+        "--aggregator",
+        help="How to aggregate results of different benchmarks",
+    ),
+    statistic: Statistic = typer.Option(
+        Statistic.target,
+        "-s",
+        "--statistic",
+        help="Statistic of repeated benchmark samples to aggregate",
+    ),
+    metric: str = typer.Option(
+        TARGET_METRIC,
+        "--metric",
+        help="Metric of the results to aggregate, e.g. throughput (default: target)",
+    ),
+    resource: str = typer.Option(
+        None,
+        "-r",
+        "--resource",
+        help="Show resource usage of a phase instead of benchmark results, e.g. build.wall_time or benchmark.max_rss",
+    ),
+    normalize: Normalization = typer.Option(
+        None,
+        "-m",
+        "--normalize",
+        help="Include runs of other machines, rescaled by calibration results or by factors fitted from commits measured on several machines",
+    ),
+    labels: List[str] = typer.Option(
+        [],
+        "-L",
+        "--label",
+        help="Only benchmarks with this label (repeatable, any of them)",
+    ),
+    exclude_labels: List[str] = typer.Option(
+        [],
+        "--exclude-label",
+        help="Leave out benchmarks with this label (repeatable)",
+    ),
+    by_label: bool = typer.Option(
+        False,
+        "--by-label",
+        help="Show one ranking per label",
+    ),
+    baseline: str = typer.Option(
+        None,
+        "-b",
+        "--baseline",
+        help="Classify benchmarks of the current run against the run of this commit",
+    ),
+    commit_order: bool = typer.Option(
+        False,
+        "-c",
+        "--commit-order",
+        help="Sort results by commit order. If false, results will be shown in score order (default: false)",
+    ),
+    same_env: bool = typer.Option(
+        False,
+        "--same-env",
+        help="Leave out runs of this machine measured in another environment than the newest run (CPU, governor, kernel, ...)",
+    ),
+) -> None:
+    """Switch active experiment"""
+    params = dict(
+        limit=limit,
+        max_commits=max_commits,
+        since=since,
+        aggregator=aggregator,
+        statistic=statistic,
+        metric=metric,
+        resource=resource,
+        normalize=normalize,
+        labels=labels,
+        exclude_labels=exclude_labels,
+        by_label=by_label,
+        baseline=baseline,
+        commit_order=commit_order,
+        same_env=same_env,
+    )
+    from benchmark_keeper.client import query_daemon
+
+    data = query_daemon("list", params)
+    print_list(data if data is not None else list_data(**params))
@@ -0,0 +1,50 @@
+from benchmark_keeper import (
+    REPORT_FILE,
+    RUNS_DIR,
+    TRACKED_DIR,
+    Report,
+    Storage,
+    app,
+    console,
+    get_config,
+    get_path,
+    print_error,
+    write_repo_config,
+)
+import typer
+
+from benchmark_keeper.git import git_add_files, git_remove_file
+from benchmark_keeper.report import read_runs, unique_runs
+from benchmark_keeper.shards import write_shard
+
+
+@app.command(name="migrate")
+def migrate() -> None:
+    """Moves runs from report.yml to sharded storage"""
+
+    config = get_config()
+
+    if config.repo_config.storage == Storage.sharded:
+        console.print("Already using sharded storage")
+        raise typer.Exit()
+
+    if not isinstance((runs := read_runs()), Report):
+        print_error(
+            f"{REPORT_FILE} file badly formatted. Fix or delete it to continue."
+        )
+        raise typer.Exit(1)
+
+    migrated = unique_runs(runs.runs)
+    for run in migrated:
+        write_shard(run)
+
+    write_repo_config(
+        config.repo_config.model_copy(update={"storage": Storage.sharded})
+    )
+
+    report_path = TRACKED_DIR + "/" + REPORT_FILE
+    git_remove_file(report_path)
+    get_path().joinpath(report_path).unlink(missing_ok=True)
+    git_add_files()
+
+    console.print(f"Moved {len(migrated)} runs to {TRACKED_DIR}/{RUNS_DIR}")
@@ -0,0 +1,155 @@
+import shutil
+from typing import Dict, List
+
+import typer
+
+from benchmark_keeper import (
+    LOCAL_DIR,
+    PENDING_REPORT,
+    REPORT_FILE,
+    RUNS_DIR,
+    TRACKED_DIR,
+    BenchmarkRun,
+    Report,
+    Storage,
+    app,
+    console,
+    get_config,
+    get_path,
+    print_error,
+    write_repo_config,
+)
+from benchmark_keeper.git import (
+    git_add_files,
+    git_remove_file,
+    range_commits,
+    rev_parse,
+)
+from benchmark_keeper.notes import NOTES_REF
+from benchmark_keeper.report import (
+    add_note_runs,
+    get_current_run,
+    get_history,
+    get_own_runs,
+    read_runs,
+    report_lock,
+    write_runs,
+)
+
+notes_app = typer.Typer(help="Run storage in git notes")
+app.add_typer(notes_app, name="notes")
+
+
+@notes_app.command(name="import")
+def import_notes(
+    revision_range: str = typer.Argument(
+        "HEAD", help="Commits whose runs are copied, along first parents"
+    ),
+) -> None:
+    """Moves the runs of report files and local runs into notes of the commits that measured them, switching to notes storage"""
+
+    config = get_config()
+
+    commits = [commit for commit, _ in range_commits(revision_range)]
+    commit_runs: Dict[str, List[BenchmarkRun]] = {}
+    imported = set()
+    for experiment in config.repo_config.experiments:
+        for commit, run in get_own_runs(
+            commits, experiment.name, experiment.version
+        ).items():
+            commit_runs.setdefault(commit, []).append(run)
+            imported.add(run.tag)
+
+    # Current runs that aren't committed yet wait for a commit
+    pending = [
+        run
+        for experiment in config.repo_config.experiments
+        if isinstance(
+            run := get_current_run(experiment.name, experiment.version), BenchmarkRun
+        )
+        and run.tag not in imported
+    ]
+
+    with report_lock():
+        add_note_runs(commit_runs, "Import benchmark runs")
+        if pending:
+            write_runs(Report(runs=pending), pending=True)
+
+    if config.repo_config.storage != Storage.notes:
+        write_repo_config(
+            config.repo_config.model_copy(update={"storage": Storage.notes})
+        )
+        for path in (f"{TRACKED_DIR}/{REPORT_FILE}", f"{TRACKED_DIR}/{RUNS_DIR}"):
+            git_remove_file(path)
+        get_path().joinpath(TRACKED_DIR, REPORT_FILE).unlink(missing_ok=True)
+        shutil.rmtree(get_path().joinpath(TRACKED_DIR, RUNS_DIR), ignore_errors=True)
+        git_add_files()
+
+    console.print(
+        f"Attached {len(imported)} runs to {len(commit_runs)} commits in {NOTES_REF}"
+    )
+    if pending:
+        console.print(
+            f"{len(pending)} uncommitted runs wait for a commit (see notes attach)"
+        )
+
+
+@notes_app.command(name="export")
+def export_notes() -> None:
+    """Writes the latest run of every experiment to report.yml and switches back to it"""
+
+    config = get_config()
+
+    if config.repo_config.storage != Storage.notes:
+        console.print("Not using notes storage")
+        raise typer.Exit()
+
+    # Newest first
+    commits = [commit for commit, _ in range_commits("HEAD")][::-1]
+    runs = []
+    for experiment in config.repo_config.experiments:
+        run = get_current_run(experiment.name, experiment.version)
+        if not isinstance(run, BenchmarkRun):
+            # Like report.yml, carry over the run of the last commit that measured the experiment
+            history = get_history(commits, experiment.name, experiment.version)
+            run = next(
+                (r for c in commits if isinstance(r := history[c], BenchmarkRun)),
+                None,
+            )
+        if run is not None:
+            runs.append(run)
+
+    with report_lock():
+        write_runs(Report(runs=runs))
+        get_path().joinpath(LOCAL_DIR, PENDING_REPORT).unlink(missing_ok=True)
+    write_repo_config(config.repo_config.model_copy(update={"storage": Storage.report}))
+    git_add_files()
+
+    console.print(
+        f"Wrote {len(runs)} runs to {TRACKED_DIR}/{REPORT_FILE}. Runs in notes stay part of the history."
+    )
+
+
+@notes_app.command(name="attach")
+def attach(
+    revision: str = typer.Argument("HEAD", help="Commit that was measured"),
+) -> None:
+    """Attaches the runs measured with uncommitted changes to a commit, once they are committed"""
+
+    if (commit := rev_parse(revision)) is None:
+        print_error(f'Revision "{revision}" not found')
+        raise typer.Exit(1)
+
+    with report_lock():
+        if not isinstance((runs := read_runs(pending=True)), Report):
+            print_error(
+                f"{PENDING_REPORT} file badly formatted. Fix or delete it to continue."
+            )
+            raise typer.Exit(1)
+        if not runs.runs:
+            console.print("No runs wait for a commit")
+            raise typer.Exit()
+        add_note_runs({commit: runs.runs})
+        write_runs(Report(runs=[]), pending=True)
+
+    console.print(f"Attached {len(runs.runs)} runs to {commit[:10]}")
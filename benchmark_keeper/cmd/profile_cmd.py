@@ -0,0 +1,56 @@
+import typer
+
+from benchmark_keeper import Color, app, console, get_config, print_error
+from benchmark_keeper.cmd.check_cmd import get_baseline_run
+from benchmark_keeper.profiles import load_profile, self_times
+
+
+@app.command(name="profile-diff")
+def profile_diff(
+    rev_a: str = typer.Argument(..., help="Commit of the base run"),
+    rev_b: str = typer.Argument(..., help="Commit of the compared run"),
+    benchmark: str = typer.Option(
+        None, "-b", "--benchmark", help="Only compare stacks of this benchmark"
+    ),
+    limit: int = typer.Option(
+        20, "-l", "--limit", min=1, help="Number of functions to show"
+    ),
+) -> None:
+    """Shows the functions whose self time changed most between the profiled runs of two commits"""
+
+    config = get_config()
+
+    if (experiment := config.active_experiment) is None:
+        print_error("No active experiment found")
+        raise typer.Exit(1)
+
+    profiles = []
+    for rev in (rev_a, rev_b):
+        run = get_baseline_run(rev, experiment.name, experiment.version)
+        if (stacks := load_profile(run.tag)) is None:
+            print_error(
+                f'No profile stored for the run of "{rev}".',
+                "Run benchmark --profile first.",
+            )
+            raise typer.Exit(1)
+        profiles.append(self_times(stacks, benchmark))
+
+    a, b = profiles
+    if not a and not b:
+        print_error(f'No stacks found for benchmark "{benchmark}"')
+        raise typer.Exit(1)
+
+    deltas = sorted(
+        ((func, a.get(func, 0), b.get(func, 0)) for func in a.keys() | b.keys()),
+        key=lambda x: -abs(x[2] - x[1]),
+    )
+    console.print(f"Self time (profile units) {rev_a} -> {rev_b}:")
+    for func, before, after in deltas[:limit]:
+        if before == after:
+            break
+        color = Color.red if after > before else Color.green
+        console.print(
+            f"[{color}]{after - before:+12d}[/{color}] {before:>12d} -> {after:<12d} {func}"
+        )
+    total_a, total_b = sum(a.values()), sum(b.values())
+    console.print(f"Total: {total_a} -> {total_b} ({total_b - total_a:+d})")
@@ -0,0 +1,102 @@
+import json
+import signal
+import socket
+import socketserver
+import sys
+import time
+from typing import Any, Callable, Dict, Mapping
+
+import typer
+
+from benchmark_keeper import app, console, print_error, reset_config
+from benchmark_keeper.client import PROTOCOL, socket_path
+from benchmark_keeper.cmd.compare_cmd import compare_data
+from benchmark_keeper.cmd.list_cmd import list_data
+from benchmark_keeper.cmd.trend_cmd import trend_data
+
+# Command -> function computing its result
+QUERIES: Dict[str, Callable[..., Any]] = {
+    "list": list_data,
+    "compare": compare_data,
+    "trend": trend_data,
+}
+
+
+def answer(request: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Response to one request. Committed runs and the commit list stay loaded between requests,
+    config, current run and local runs are read again.
+    """
+    response = {
+        "version": PROTOCOL,
+        "ok": True,
+        "output": "",
+        "result": None,
+        "exit_code": 0,
+    }
+    if request.get("version") != PROTOCOL:
+        # The client sees the version mismatch and computes its result itself
+        return response
+
+    reset_config()
+    with console.capture() as capture:
+        try:
+            response["result"] = QUERIES[request["command"]](**request["args"])
+        except typer.Exit as e:
+            response.update(ok=False, exit_code=e.exit_code)
+        except Exception as e:
+            print_error("Daemon query failed", repr(e))
+            response.update(ok=False, exit_code=1)
+    response["output"] = capture.get()
+    return response
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        start = time.perf_counter()
+        response = answer(request)
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+        console.print(
+            f"{request.get('command')}: exit code {response['exit_code']} in {time.perf_counter() - start:.3f}s"
+        )
+
+
+def _daemon_running(path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except OSError:
+            return False
+    return True
+
+
+@app.command(name="serve")
+def serve() -> None:
+    """Keeps the history in memory and answers list, compare and trend of other calls"""
+
+    path = socket_path()
+    if path.exists():
+        if _daemon_running(path):
+            print_error("A daemon is already running", f"at {path}")
+            raise typer.Exit(1)
+        path.unlink()
+
+    console.print("Loading history")
+    start = time.perf_counter()
+    answer({"version": PROTOCOL, "command": "list", "args": {}})
+    console.print(f"Loaded in {time.perf_counter() - start:.3f}s")
+
+    # Stopping with SIGTERM removes the socket like Ctrl-C does
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with socketserver.UnixStreamServer(str(path), _Handler) as server:
+        console.print(f"Serving on {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            path.unlink(missing_ok=True)
@@ -13,9 +13,13 @@ def switch(
     for exp in config.repo_config.experiments:
         if exp.name == experiment:
             console.print(f'Switching to experiment "{experiment}"')
-            write_local_config(
-                config.local_config.model_copy(update={"active_experiment": experiment})
-            )
+            # Rewriting an unchanged config would invalidate the config cache
+            if config.local_config.active_experiment != experiment:
+                write_local_config(
+                    config.local_config.model_copy(
+                        update={"active_experiment": experiment}
+                    )
+                )
             raise typer.Exit()
 
     console.print("Experiment not found. First five Experiments are:")
@@ -0,0 +1,136 @@
+from fnmatch import fnmatchcase
+from typing import Any, Dict, List, Optional, Tuple
+
+import typer
+
+from benchmark_keeper import Color, Statistic, app, console, get_config, print_error
+from benchmark_keeper.client import query_daemon
+from benchmark_keeper.changepoint import default_penalty, level_shifts, load_numpy
+from benchmark_keeper.git import range_commits
+from benchmark_keeper.report import get_own_runs
+
+
+def trend_data(
+    revision_range: str = "HEAD",
+    benchmark: Optional[str] = None,
+    statistic: str = Statistic.target,
+    penalty: Optional[float] = None,
+    min_shift: float = 1.0,
+) -> Dict[str, Any]:
+    """Level shifts, largest first (see trend for the parameters)"""
+
+    config = get_config()
+
+    if (experiment := config.active_experiment) is None:
+        print_error("No active experiment found")
+        raise typer.Exit(1)
+
+    statistic = Statistic(statistic)
+    commits = range_commits(revision_range)
+    subjects = dict(commits)
+    runs = [
+        (commit, run)
+        for commit, run in get_own_runs(
+            [commit for commit, _ in commits], experiment.name, experiment.version
+        ).items()
+        if run.machine == config.local_config.machine_name
+    ]
+
+    # Benchmark -> (commit, value) in commit order
+    series: Dict[str, List[Tuple[str, float]]] = {}
+    for commit, run in runs:
+        for name, result in run.benchmarks.items():
+            if benchmark is None or fnmatchcase(name, benchmark):
+                series.setdefault(name, []).append(
+                    (commit, result.statistic(statistic))
+                )
+
+    np = load_numpy(sum(map(len, series.values())))
+    shifts = []
+    for name, points in series.items():
+        values = [value for _, value in points]
+        for i, before, after in level_shifts(
+            values,
+            penalty if penalty is not None else default_penalty(len(values)),
+            np,
+        ):
+            rel = after / before - 1 if before != 0 else 0.0
+            if abs(rel) * 100 >= min_shift:
+                commit = points[i][0]
+                shifts.append(
+                    {
+                        "benchmark": name,
+                        "commit": commit,
+                        "subject": subjects[commit],
+                        "before": before,
+                        "after": after,
+                        "relative_change": rel,
+                    }
+                )
+    shifts.sort(key=lambda x: -abs(x["relative_change"]))
+
+    return {
+        "experiment": experiment.name,
+        "machine": config.local_config.machine_name,
+        "benchmarks": len(series),
+        "runs": len(runs),
+        "shifts": shifts,
+    }
+
+
+def print_trend(data: Dict[str, Any], limit: int):
+    if not data["benchmarks"]:
+        console.print(
+            f"No results found for experiment {data['experiment']} on machine {data['machine']}"
+        )
+        return
+
+    shifts = data["shifts"]
+    console.print(
+        f"{len(shifts)} level shifts in {data['benchmarks']} benchmarks over {data['runs']} runs"
+    )
+    for shift in shifts[:limit]:
+        rel = shift["relative_change"]
+        color = Color.red if rel > 0 else Color.green
+        console.print(
+            f"[{color}]{rel:+8.2%}[/{color}] {shift['benchmark']}: {shift['before']:.4g} -> {shift['after']:.4g} at {shift['commit'][:10]}, {shift['subject']}"
+        )
+    if len(shifts) > limit:
+        console.print(f"... and {len(shifts) - limit} more")
+
+
+@app.command(name="trend")
+def trend(
+    revision_range: str = typer.Argument(
+        "HEAD", help="Commits to analyze along first parents, e.g. v1.0..HEAD"
+    ),
+    benchmark: str = typer.Option(
+        None, "-b", "--benchmark", help="Only benchmarks matching this glob pattern"
+    ),
+    statistic: Statistic = typer.Option(
+        Statistic.target, "-s", "--statistic", help="Statistic of repeated samples"
+    ),
+    penalty: float = typer.Option(
+        None,
+        "-p",
+        "--penalty",
+        help="Minimum noise scaled error reduction per shift. Higher finds fewer. Default: 3 ln(runs)",
+    ),
+    min_shift: float = typer.Option(
+        1.0, "-t", "--min-shift", help="Hide shifts smaller than this percentage"
+    ),
+    limit: int = typer.Option(
+        20, "-l", "--limit", min=1, help="Number of shifts to show"
+    ),
+) -> None:
+    """Finds commits where the level of a benchmark shifted, in commit order"""
+    params = dict(
+        revision_range=revision_range,
+        benchmark=benchmark,
+        statistic=statistic,
+        penalty=penalty,
+        min_shift=min_shift,
+    )
+    if (data := query_daemon("trend", params)) is None:
+        data = trend_data(**params)
+    print_trend(data, limit)
@@ -0,0 +1,300 @@
+import subprocess
+import time
+from threading import Thread
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import typer
+
+from benchmark_keeper import (
+    AppConfig,
+    BenchmarkRun,
+    Color,
+    Experiment,
+    ResourceUsage,
+    app,
+    console,
+    get_config,
+    get_path,
+    print_error,
+    stat_key,
+)
+from benchmark_keeper.calibration import run_calibration
+from benchmark_keeper.cmd.benchmark_cmd import kill_group, run_benchmarks
+from benchmark_keeper.digest import expand_watch_files, watch_digest
+from benchmark_keeper.environment import collect_fingerprint
+from benchmark_keeper.formatting import ScriptDelimiter
+from benchmark_keeper.git import git_add_files
+from benchmark_keeper.labels import label_env, select_results
+from benchmark_keeper.report import add_run, get_current_run
+from benchmark_keeper.resources import record as record_usage, wait_usage
+from benchmark_keeper.stats import Change, compare_runs, run_ratio
+
+
+class Watcher(object):
+    """Polls the stat_key of the watched files"""
+
+    def __init__(self, patterns: List[str]) -> None:
+        self.patterns = patterns
+        self.snapshot = self.stat()
+
+    def stat(self) -> Dict[str, Optional[Tuple[int, int, int]]]:
+        root = get_path()
+        snapshot: Dict[str, Optional[Tuple[int, int, int]]] = {}
+        for file in expand_watch_files(self.patterns):
+            try:
+                snapshot[file] = stat_key(root.joinpath(file))
+            except FileNotFoundError:
+                snapshot[file] = None
+        return snapshot
+
+    def changed(self) -> bool:
+        """Whether files changed since the last call"""
+        snapshot = self.stat()
+        changed = snapshot != self.snapshot
+        self.snapshot = snapshot
+        return changed
+
+    def wait_change(self, interval: float):
+        while not self.changed():
+            time.sleep(interval)
+
+    def settle(self, interval: float, debounce: float):
+        """Waits until no file changed for debounce seconds, so a burst of edits runs once"""
+        quiet_since = time.monotonic()
+        while time.monotonic() - quiet_since < debounce:
+            time.sleep(interval)
+            if self.changed():
+                quiet_since = time.monotonic()
+
+
+def run_cancelable(
+    script: str,
+    phase: str,
+    cancel: Callable[[], bool],
+    interval: float,
+    resources: Dict[str, ResourceUsage],
+) -> Optional[int]:
+    """Like run_script, but kills the script and returns None as soon as cancel() is true"""
+    start = time.monotonic()
+    with ScriptDelimiter(script):
+        proc = subprocess.Popen([script], start_new_session=True)
+        waited: List[Tuple[int, ResourceUsage]] = []
+        waiter = Thread(target=lambda: waited.append(wait_usage(proc, start)))
+        waiter.start()
+        try:
+            while waiter.is_alive():
+                waiter.join(interval)
+                if waiter.is_alive() and cancel():
+                    kill_group(proc)
+                    waiter.join()
+                    return None
+        except BaseException:
+            # Ctrl-C only reaches our process group
+            kill_group(proc)
+            raise
+    returncode, usage = waited[0]
+    record_usage(resources, phase, usage)
+    return returncode
+
+
+def print_delta(title: str, base: BenchmarkRun, run: BenchmarkRun):
+    """One line: geometric mean change and counts of classified benchmarks"""
+    changes = compare_runs(base, run)
+    slower = sum(change == Change.slower for change, _ in changes.values())
+    faster = sum(change == Change.faster for change, _ in changes.values())
+    if (ratio := run_ratio(base, run)) is not None:
+        color = Color.red if ratio > 1 else Color.green
+        rel = f"[{color}]{ratio - 1:+8.2%}[/{color}]"
+    else:
+        rel = " " * 8
+    console.print(
+        f"{rel} {title}: {slower} slower, {faster} faster, {len(changes) - slower - faster} within noise"
+    )
+
+
+class _Canceled(Exception):
+    pass
+
+
+def watch_cycle(
+    config: AppConfig,
+    experiment: Experiment,
+    watcher: Watcher,
+    digest: str,
+    interval: float,
+    cancel: bool,
+    repeat: int,
+    warmup: int,
+    labels: List[str],
+    exclude_labels: List[str],
+    calibrate: bool,
+) -> Optional[BenchmarkRun]:
+    """
+    Builds, tests and benchmarks the working tree. Returns None if a script failed.
+    Build and tests are canceled (raising _Canceled) when watched files change meanwhile,
+    benchmarks are not, so polling doesn't disturb them.
+    """
+    resources: Dict[str, ResourceUsage] = {}
+    for script, phase in (
+        (experiment.build_script, "build"),
+        (experiment.test_script, "test"),
+    ):
+        if script is None:
+            continue
+        returncode = run_cancelable(
+            script,
+            phase,
+            watcher.changed if cancel else lambda: False,
+            interval,
+            resources,
+        )
+        if returncode is None:
+            raise _Canceled()
+        if returncode != 0:
+            print_error(f"{phase.capitalize()} failed")
+            return None
+        if not cancel:
+            # Changes made by the build itself don't start another cycle
+            watcher.changed()
+
+    fingerprint = collect_fingerprint()
+    calibration = run_calibration(experiment) if calibrate else None
+    results, complete = run_benchmarks(
+        experiment,
+        repeat,
+        warmup,
+        resources=resources,
+        env=label_env(labels, exclude_labels),
+    )
+    return BenchmarkRun(
+        tag=uuid4().hex,
+        experiment=experiment.name,
+        experiment_version=experiment.version,
+        machine=config.local_config.machine_name,
+        benchmarks=select_results(results, labels, exclude_labels),
+        # A run of some labels only is not a complete run either
+        incomplete=not complete or bool(labels or exclude_labels),
+        resources=resources,
+        calibration=calibration,
+        fingerprint=fingerprint,
+        file_digest=digest,
+    )
+
+
+@app.command(name="watch")
+def watch(
+    interval: float = typer.Option(
+        0.5, "-i", "--interval", min=0.01, help="Seconds between polls of watched files"
+    ),
+    debounce: float = typer.Option(
+        1.0,
+        "--debounce",
+        min=0,
+        help="Seconds without further changes before a run starts",
+    ),
+    cancel: bool = typer.Option(
+        True,
+        "--cancel/--no-cancel",
+        help="Restart build and tests when watched files change meanwhile. Disable if the build writes watched files.",
+    ),
+    repeat: int = typer.Option(
+        1, "-n", "--repeat", min=1, help="Number of times to run the benchmark script"
+    ),
+    warmup: int = typer.Option(
+        0,
+        "-w",
+        "--warmup",
+        min=0,
+        help="Number of discarded runs of the benchmark script before measuring",
+    ),
+    labels: List[str] = typer.Option(
+        [],
+        "-L",
+        "--label",
+        help="Only run benchmarks with this label (repeatable). Passed to the script as $BENCHK_LABELS.",
+    ),
+    exclude_labels: List[str] = typer.Option(
+        [],
+        "--exclude-label",
+        help="Skip benchmarks with this label (repeatable). Passed to the script as $BENCHK_EXCLUDE_LABELS.",
+    ),
+    record: bool = typer.Option(
+        False, "--record", help="Store every run as the current run, like benchmark"
+    ),
+) -> None:
+    """Benchmarks the working tree again whenever watched files change"""
+
+    config = get_config()
+
+    if (experiment := config.active_experiment) is None:
+        print_error("No active experiment found")
+        raise typer.Exit(1)
+    if not experiment.watch_files:
+        print_error(f'Experiment "{experiment.name}" has no watch_files')
+        raise typer.Exit(1)
+
+    current = get_current_run(experiment.name, experiment.version)
+    # Runs are compared against the previous one and the best one, starting with the current run
+    previous = current if isinstance(current, BenchmarkRun) else None
+    best = previous
+
+    watcher = Watcher(experiment.watch_files)
+    digest = None
+    pending = True
+    try:
+        while True:
+            if not pending:
+                console.print(
+                    f"[{Color.yellow}]Waiting for changes of watched files[/{Color.yellow}]"
+                )
+                watcher.wait_change(interval)
+                watcher.settle(interval, debounce)
+            pending = False
+
+            new_digest = watch_digest(experiment)
+            if new_digest == digest:
+                console.print("Watched files unchanged")
+                continue
+            try:
+                run = watch_cycle(
+                    config,
+                    experiment,
+                    watcher,
+                    new_digest,
+                    interval,
+                    cancel,
+                    repeat,
+                    warmup,
+                    labels,
+                    exclude_labels,
+                    calibrate=record,
+                )
+            except _Canceled:
+                console.print("Watched files changed. Restarting.")
+                watcher.settle(interval, debounce)
+                pending = True
+                continue
+            except typer.Exit:
+                # The benchmark script failed and its error is printed
+                run = None
+            digest = new_digest
+            if run is None:
+                continue
+
+            if record:
+                add_run(run)
+                git_add_files()
+
+            if previous is not None:
+                print_delta("against previous run", previous, run)
+            if best is not None and best is not previous:
+                print_delta("against best run", best, run)
+            if best is None or (
+                (ratio := run_ratio(best, run)) is not None and ratio < 1
+            ):
+                console.print(f"[{Color.yellow}]New best run[/{Color.yellow}]")
+                best = run
+            previous = run
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,170 @@
+"""Digest of the watched files of an experiment, used to skip unchanged benchmarks"""
+
+import glob
+import hashlib
+import os
+import pathlib
+import sqlite3
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import typer
+
+from benchmark_keeper import (
+    DIGEST_CACHE,
+    LOCAL_DIR,
+    TRACKED_DIR,
+    Experiment,
+    get_path,
+    is_racy,
+    print_error,
+    stat_key,
+)
+
+# Rewritten by every run: reports, shards and notes (in .git), local state
+_IGNORED_DIRS = {".git", LOCAL_DIR, TRACKED_DIR}
+
+
+def _ignored(path: str) -> bool:
+    return any(part in _IGNORED_DIRS for part in pathlib.PurePath(path).parts)
+
+
+def _walk(path: str) -> List[str]:
+    files = []
+    for dirpath, dirnames, names in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if d not in _IGNORED_DIRS)
+        files.extend(os.path.join(dirpath, name) for name in sorted(names))
+    return files
+
+
+def expand_watch_files(patterns: List[str]) -> List[str]:
+    """
+    Expands glob patterns and directories into files (relative to the repository root).
+    Order follows the patterns, duplicates are removed.
+    """
+    root = get_path()
+    files: Dict[str, None] = {}
+    for pattern in patterns:
+        path = root.joinpath(pattern)
+        if path.is_dir():
+            matches = _walk(str(path))
+        elif glob.has_magic(pattern):
+            matches = sorted(
+                m
+                for m in glob.glob(str(path), recursive=True)
+                if os.path.isfile(m) and not _ignored(os.path.relpath(m, root))
+            )
+        else:
+            matches = [str(path)]
+        for match in matches:
+            files[os.path.relpath(match, root)] = None
+    return list(files)
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256(usedforsecurity=False)
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+class DigestCache(object):
+    """Per file digests, valid as long as their stat_key is unchanged"""
+
+    def __init__(self) -> None:
+        path = get_path().joinpath(LOCAL_DIR)
+        path.mkdir(exist_ok=True)
+        self.db = sqlite3.connect(path.joinpath(DIGEST_CACHE), timeout=30)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files "
+            "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, digest TEXT)"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.db.close()
+
+    def load(self) -> Dict[str, Tuple[Tuple[int, int, int], str]]:
+        return {
+            path: ((size, mtime_ns, inode), digest)
+            for path, size, mtime_ns, inode, digest in self.db.execute(
+                "SELECT * FROM files"
+            )
+        }
+
+    def store(self, entries: List[Tuple[str, Tuple[int, int, int], str]]):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                ((path, *key, digest) for path, key, digest in entries),
+            )
+
+
+def content_digest(files: List[str], jobs: int | None = None) -> str:
+    """
+    Combines per file SHA-256 digests. Only files whose stat changed are read,
+    and those are hashed in a thread pool.
+    """
+    root = get_path()
+    keys = {}
+    for file in files:
+        try:
+            keys[file] = stat_key(root.joinpath(file))
+        except FileNotFoundError:
+            print_error("Watched file not found:", file)
+            raise typer.Exit(1)
+
+    with DigestCache() as cache:
+        cached = cache.load()
+        digests = {
+            file: cached[file][1]
+            for file, key in keys.items()
+            if file in cached and cached[file][0] == key
+        }
+        changed = [file for file in files if file not in digests]
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            digests.update(
+                zip(changed, pool.map(file_sha256, map(root.joinpath, changed)))
+            )
+        cache.store(
+            [
+                (file, keys[file], digests[file])
+                for file in changed
+                if not is_racy(keys[file])
+            ]
+        )
+
+    h = hashlib.sha256(usedforsecurity=False)
+    for file in files:
+        h.update(f"{digests[file]} {file}\n".encode())
+    return h.hexdigest()
+
+
+def git_digest(patterns: List[str]) -> str:
+    """
+    Digest of the blob ids of the staged versions of all tracked files matching patterns.
+    Costs one git call, but unstaged changes are not seen.
+    """
+    proc = subprocess.run(
+        ["git", "ls-files", "-s", "--", *(f":(glob){p}" for p in patterns)],
+        cwd=get_path(),
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        print_error("Git command failed", proc.stderr.strip())
+        raise typer.Exit(1)
+    return hashlib.sha256(proc.stdout.encode(), usedforsecurity=False).hexdigest()
+
+
+def watch_digest(experiment: Experiment) -> str:
+    if experiment.watch_git:
+        return git_digest(experiment.watch_files)
+    return content_digest(expand_watch_files(experiment.watch_files))
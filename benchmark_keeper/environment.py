@@ -0,0 +1,90 @@
+"""
+Environment of benchmark processes: pinning as configured per experiment,
+and the fingerprint of the machine and environment recorded with every run.
+"""
+
+import functools
+import os
+import platform
+import subprocess
+from typing import Dict, Mapping, Optional, Set
+
+from benchmark_keeper import Experiment, Fingerprint
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _cpu_model() -> Optional[str]:
+    for line in (_read("/proc/cpuinfo") or "").splitlines():
+        if line.startswith("model name"):
+            return line.partition(":")[2].strip()
+    return platform.processor() or None
+
+
+@functools.lru_cache(maxsize=None)
+def _compiler() -> Optional[str]:
+    try:
+        proc = subprocess.run(
+            ["cc", "--version"], capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return proc.stdout.partition("\n")[0].strip() or None
+
+
+def collect_fingerprint() -> Fingerprint:
+    governor = _read("/sys/devices/system/cpu/cpu0/cpufreq/scaling_governor")
+    try:
+        load_average: Optional[float] = os.getloadavg()[0]
+    except OSError:
+        load_average = None
+    return Fingerprint(
+        cpu_model=_cpu_model(),
+        cores=os.cpu_count(),
+        governor=governor.strip() if governor is not None else None,
+        kernel=platform.release() or None,
+        load_average=load_average,
+        python=platform.python_version(),
+        compiler=_compiler(),
+    )
+
+
+def script_env(
+    experiment: Experiment, extra: Mapping[str, str] = {}
+) -> Optional[Dict[str, str]]:
+    """Environment of a benchmark process, None to inherit ours unchanged"""
+    if not (experiment.env or experiment.unset_env or extra):
+        return None
+    env = {**os.environ, **experiment.env, **extra}
+    for name in experiment.unset_env:
+        env.pop(name, None)
+    return env
+
+
+def pin_process(pid: int, experiment: Experiment, cpus: Optional[Set[int]] = None):
+    """
+    Pins a started benchmark process. CPUs of a concurrent slot (--pin) take precedence over the experiment's cpu_affinity.
+    Applied after the spawn rather than in preexec_fn, which is unsafe while other threads run (benchmark --jobs, backfill).
+    """
+    affinity = cpus or (
+        set(experiment.cpu_affinity) if experiment.cpu_affinity else None
+    )
+    try:
+        if affinity is not None:
+            os.sched_setaffinity(pid, affinity)
+        if experiment.nice:
+            # Like nice(1), the increment is relative to our own niceness
+            os.setpriority(
+                os.PRIO_PROCESS,
+                pid,
+                os.getpriority(os.PRIO_PROCESS, 0) + experiment.nice,
+            )
+    except ProcessLookupError:
+        # Already exited
+        pass
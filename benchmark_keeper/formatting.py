@@ -1,4 +1,8 @@
+from collections import Counter
+from typing import Mapping, Tuple
+
 from benchmark_keeper import Color, console
+from benchmark_keeper.stats import Change
 
 
 class ScriptDelimiter(object):
@@ -12,3 +16,22 @@ class ScriptDelimiter(object):
 
     def __exit__(self, type, value, traceback):
         console.print(f"[{Color.yellow}]--- Done")
+
+
+def print_changes(changes: Mapping[str, Tuple[Change, float]], limit: int = 20):
+    """Prints significant changes (largest first) and a summary"""
+    significant = sorted(
+        (item for item in changes.items() if item[1][0] != Change.noise),
+        key=lambda x: -abs(x[1][1]),
+    )
+    for name, (change, rel) in significant[:limit]:
+        color = Color.red if change == Change.slower else Color.green
+        console.print(f"[{color}]{rel:+8.2%}[/{color}] {name} ({change.value})")
+    if len(significant) > limit:
+        console.print(f"... and {len(significant) - limit} more")
+
+    counts = Counter(change for change, _ in changes.values())
+    console.print(
+        f"{counts[Change.slower]} slower, {counts[Change.faster]} faster, "
+        f"{counts[Change.noise]} within noise"
+    )
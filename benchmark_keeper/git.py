@@ -1,15 +1,68 @@
-from benchmark_keeper import console, TRACKED_DIR, REPORT_FILE, REPO_CONFIG, print_error
+from benchmark_keeper import (
+    console,
+    get_path,
+    TRACKED_DIR,
+    REPORT_FILE,
+    REPO_CONFIG,
+    RUNS_DIR,
+    print_error,
+)
 import subprocess
+from threading import Thread
+from typing import Iterable, Iterator, List, Optional, Tuple
 import typer
 
 
 def git_add_files():
-    if subprocess.call(f"git add {TRACKED_DIR+'/'+REPORT_FILE}", shell=True) != 0:
+    for file in [REPORT_FILE, REPO_CONFIG, RUNS_DIR]:
+        if not get_path().joinpath(TRACKED_DIR, file).exists():
+            continue
+        if subprocess.call(f"git add {TRACKED_DIR+'/'+file}", shell=True) != 0:
+            print_error("Git command failed")
+            raise typer.Exit(1)
+
+
+def git_remove_file(path: str):
+    if (
+        subprocess.call(["git", "rm", "-r", "-q", "--cached", "--ignore-unmatch", path])
+        != 0
+    ):
         print_error("Git command failed")
         raise typer.Exit(1)
-    if subprocess.call(f"git add {TRACKED_DIR+'/'+REPO_CONFIG}", shell=True) != 0:
-        print_error("Git command failed")
+
+
+def rev_parse(rev: str) -> Optional[str]:
+    """Full commit hash of a revision, None if it doesn't exist"""
+    proc = subprocess.run(
+        ["git", "rev-parse", "--verify", "--quiet", rev + "^{commit}"],
+        capture_output=True,
+        text=True,
+    )
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+
+def _log(*args: str) -> List[Tuple[str, str]]:
+    proc = subprocess.run(
+        ["git", "log", "--pretty=format:%H %s", *args], capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        print_error("Git command failed", proc.stderr.strip())
         raise typer.Exit(1)
+    return [
+        (line.split(" ")[0], " ".join(line.split(" ")[1:]))
+        for line in proc.stdout.strip().split("\n")
+        if line
+    ]
+
+
+def commit_range(start: str, end: str) -> List[Tuple[str, str]]:
+    """(hash, subject) of commits from start (inclusive) to end along first parents, oldest first"""
+    return _log("-1", start) + _log("--first-parent", "--reverse", f"{start}..{end}")
+
+
+def range_commits(revision_range: str) -> List[Tuple[str, str]]:
+    """(hash, subject) of commits in a range (e.g. v1.0..HEAD) along first parents, oldest first"""
+    return _log("--first-parent", "--reverse", revision_range)
 
 
 def commit_report(message):
@@ -20,3 +73,65 @@ def commit_report(message):
     if subprocess.call(f"git commit -m {message}", shell=True) != 0:
         print_error("Git command failed")
         raise typer.Exit(1)
+
+
+def _feed(stdin, names: Iterable[str]):
+    try:
+        for name in names:
+            stdin.write(name.encode() + b"\n")
+    finally:
+        stdin.close()
+
+
+def _cat_file(mode: str, names: Iterable[str]) -> subprocess.Popen:
+    """Starts one git cat-file process and feeds it names from a background thread"""
+    proc = subprocess.Popen(
+        ["git", "cat-file", mode],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    Thread(target=_feed, args=(proc.stdin, names), daemon=True).start()
+    return proc
+
+
+def batch_check(names: List[str]) -> List[Optional[str]]:
+    """Resolves object names (e.g. "<commit>:<path>") to blob ids. None if missing."""
+    if not names:
+        return []
+    proc = _cat_file("--batch-check", names)
+    oids: List[Optional[str]] = []
+    for _ in names:
+        header = proc.stdout.readline().split()  # type: ignore
+        oids.append(
+            header[0].decode() if len(header) == 3 and header[1] == b"blob" else None
+        )
+    proc.wait()
+    return oids
+
+
+def batch_read(oids: Iterable[str]) -> Iterator[Tuple[str, bytes]]:
+    """Streams contents of the given objects through one git cat-file --batch process"""
+    oids = list(oids)
+    if not oids:
+        return
+    proc = _cat_file("--batch", oids)
+    out = proc.stdout
+    for oid in oids:
+        header = out.readline().split()  # type: ignore
+        if len(header) != 3:
+            continue  # Missing object
+        content = out.read(int(header[2]))  # type: ignore
+        out.read(1)  # type: ignore
+        yield oid, content
+    proc.wait()
+
+
+def worktree_clean() -> bool:
+    """Whether tracked files are unchanged from HEAD"""
+    return (
+        subprocess.call(
+            ["git", "diff", "--quiet", "HEAD", "--"], stderr=subprocess.DEVNULL
+        )
+        == 0
+    )
@@ -0,0 +1,100 @@
+"""
+Selection of benchmarks by their labels.
+
+Every loaded run gets a label -> benchmark names index (built once, cached by run tag),
+so selections are set operations instead of scans over all results.
+"""
+
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional
+
+from benchmark_keeper import BenchmarkResult, BenchmarkRun
+
+# Selected labels are passed to benchmark scripts as comma separated lists
+LABELS_ENV = "BENCHK_LABELS"
+EXCLUDE_LABELS_ENV = "BENCHK_EXCLUDE_LABELS"
+
+_indexes: Dict[str, Dict[str, FrozenSet[str]]] = {}
+
+
+def build_index(benchmarks: Mapping[str, BenchmarkResult]) -> Dict[str, FrozenSet[str]]:
+    index: Dict[str, set] = {}
+    for name, result in benchmarks.items():
+        for label in result.labels:
+            index.setdefault(label, set()).add(name)
+    return {label: frozenset(names) for label, names in index.items()}
+
+
+def label_index(run: BenchmarkRun) -> Dict[str, FrozenSet[str]]:
+    if (index := _indexes.get(run.tag)) is None:
+        index = _indexes[run.tag] = build_index(run.benchmarks)
+    return index
+
+
+def _selected_names(
+    index: Mapping[str, FrozenSet[str]],
+    names: Iterable[str],
+    labels: List[str],
+    exclude_labels: List[str],
+) -> FrozenSet[str]:
+    """Benchmarks with any of labels (all if none are given) and none of exclude_labels"""
+    selected = (
+        frozenset().union(*(index.get(label, ()) for label in labels))
+        if labels
+        else frozenset(names)
+    )
+    return selected.difference(*(index.get(label, ()) for label in exclude_labels))
+
+
+def select(
+    run: BenchmarkRun,
+    labels: List[str],
+    exclude_labels: List[str],
+    benchmarks: Optional[Mapping[str, BenchmarkResult]] = None,
+) -> Mapping[str, BenchmarkResult]:
+    """
+    Results of the selected benchmarks of run.
+    benchmarks replaces the results of run (e.g. rescaled ones), keeping its index.
+    """
+    benchmarks = run.benchmarks if benchmarks is None else benchmarks
+    if not labels and not exclude_labels:
+        return benchmarks
+    return {
+        name: benchmarks[name]
+        for name in _selected_names(
+            label_index(run), run.benchmarks, labels, exclude_labels
+        )
+        if name in benchmarks
+    }
+
+
+def select_results(
+    benchmarks: Mapping[str, BenchmarkResult],
+    labels: List[str],
+    exclude_labels: List[str],
+) -> Mapping[str, BenchmarkResult]:
+    """Like select, for results that don't belong to a run yet"""
+    if not labels and not exclude_labels:
+        return benchmarks
+    return {
+        name: benchmarks[name]
+        for name in _selected_names(
+            build_index(benchmarks), benchmarks, labels, exclude_labels
+        )
+    }
+
+
+def select_run(
+    run: BenchmarkRun, labels: List[str], exclude_labels: List[str]
+) -> BenchmarkRun:
+    if not labels and not exclude_labels:
+        return run
+    return run.model_copy(update={"benchmarks": select(run, labels, exclude_labels)})
+
+
+def label_env(labels: List[str], exclude_labels: List[str]) -> Dict[str, str]:
+    env = {}
+    if labels:
+        env[LABELS_ENV] = ",".join(labels)
+    if exclude_labels:
+        env[EXCLUDE_LABELS_ENV] = ",".join(exclude_labels)
+    return env
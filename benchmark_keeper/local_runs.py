@@ -0,0 +1,61 @@
+"""
+Runs recorded against past commits (not committed to the repository).
+They are read by list alongside the runs in committed reports.
+"""
+
+import sqlite3
+from typing import Dict, Iterable, Tuple
+
+from benchmark_keeper import LOCAL_DIR, LOCAL_RUNS, BenchmarkRun, get_path
+
+
+def _connect() -> sqlite3.Connection:
+    path = get_path().joinpath(LOCAL_DIR)
+    path.mkdir(exist_ok=True)
+    db = sqlite3.connect(path.joinpath(LOCAL_RUNS), timeout=30)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS runs (commit_id TEXT, experiment TEXT, "
+        "experiment_version INTEGER, run TEXT, "
+        "PRIMARY KEY (commit_id, experiment, experiment_version))"
+    )
+    return db
+
+
+def add_commit_run(commit_id: str, run: BenchmarkRun):
+    db = _connect()
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?)",
+            (
+                commit_id,
+                run.experiment,
+                run.experiment_version,
+                run.model_dump_json(exclude_defaults=True),
+            ),
+        )
+    db.close()
+
+
+def get_local_runs(experiment: str, experiment_version: int) -> Dict[str, BenchmarkRun]:
+    """Maps commit ids to their recorded run"""
+    db = _connect()
+    rows = db.execute(
+        "SELECT commit_id, run FROM runs WHERE experiment = ? AND experiment_version = ?",
+        (experiment, experiment_version),
+    ).fetchall()
+    db.close()
+    return {commit_id: BenchmarkRun.model_validate_json(run) for commit_id, run in rows}
+
+
+def remove_commit_runs(runs: Iterable[Tuple[str, BenchmarkRun]]):
+    """Removes the recorded runs of (commit id, run of the same experiment version) pairs"""
+    db = _connect()
+    with db:
+        db.executemany(
+            "DELETE FROM runs WHERE commit_id = ? AND experiment = ? AND experiment_version = ?",
+            (
+                (commit_id, run.experiment, run.experiment_version)
+                for commit_id, run in runs
+            ),
+        )
+    db.close()
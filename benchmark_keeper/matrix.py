@@ -0,0 +1,153 @@
+"""
+Dense runs x benchmarks matrix of results, so aggregations are computed as batch operations.
+Uses NumPy if it is installed (extra "fast"), plain Python lists otherwise.
+NumPy is only imported for matrices large enough to amortize its import time,
+which dominates CLI startup.
+"""
+
+import math
+from typing import Any, Callable, Dict, List, Mapping
+
+from benchmark_keeper import BenchmarkResult
+
+# Smaller matrices are faster to aggregate in Python than to import NumPy for
+_NUMPY_MIN_CELLS = 10_000
+
+
+def _load_numpy() -> Any:
+    try:
+        import numpy
+
+        return numpy
+    except ImportError:
+        return None
+
+
+class ResultMatrix(object):
+    """
+    values[run][benchmark] holds the value of a result, mask[run][benchmark] whether it exists.
+    """
+
+    def __init__(
+        self,
+        results: List[Mapping[str, BenchmarkResult]],
+        value: Callable[[BenchmarkResult], float],
+    ) -> None:
+        index: Dict[str, int] = {}
+        for res in results:
+            for name in res:
+                index.setdefault(name, len(index))
+        self.benchmarks = list(index)
+        self.n_runs, self.n_benchmarks = len(results), len(index)
+        self.np = (
+            _load_numpy()
+            if self.n_runs * self.n_benchmarks >= _NUMPY_MIN_CELLS
+            else None
+        )
+
+        if (np := self.np) is not None:
+            self.values = np.zeros((self.n_runs, self.n_benchmarks))
+            self.mask = np.zeros((self.n_runs, self.n_benchmarks), dtype=bool)
+            for i, res in enumerate(results):
+                cols = np.fromiter(map(index.__getitem__, res), int, len(res))
+                self.values[i, cols] = np.fromiter(
+                    map(value, res.values()), float, len(res)
+                )
+                self.mask[i, cols] = True
+        else:
+            self.values = [[0.0] * self.n_benchmarks for _ in results]
+            self.mask = [[False] * self.n_benchmarks for _ in results]
+            for i, res in enumerate(results):
+                row, mrow = self.values[i], self.mask[i]
+                for name, result in res.items():
+                    row[index[name]] = value(result)
+                    mrow[index[name]] = True
+
+    def common(self) -> List[int]:
+        """Columns of benchmarks present in every run"""
+        if self.n_runs == 0:
+            return []
+        if (np := self.np) is not None:
+            return np.flatnonzero(self.mask.all(axis=0)).tolist()
+        return [
+            j for j in range(self.n_benchmarks) if all(mrow[j] for mrow in self.mask)
+        ]
+
+    def mean_rank(self) -> List[float]:
+        """
+        Mean rank of every run over the common benchmarks (0 is the lowest value).
+        Ties are ranked in run order.
+        """
+        cols = self.common()
+        if not cols:
+            return [0.0] * self.n_runs
+        if (np := self.np) is not None:
+            sub = self.values[:, cols]
+            order = np.argsort(sub, axis=0, kind="stable")
+            ranks = np.empty_like(order)
+            ranks[order, np.arange(len(cols))] = np.arange(self.n_runs)[:, None]
+            return (ranks.sum(axis=1) / len(cols)).tolist()
+        score = [0.0] * self.n_runs
+        for j in cols:
+            order = sorted(range(self.n_runs), key=lambda i: self.values[i][j])
+            for rank, i in enumerate(order):
+                score[i] += rank
+        return [s / len(cols) for s in score]
+
+    def mean(self) -> List[float]:
+        """Arithmetic mean of every run over its own benchmarks"""
+        if (np := self.np) is not None:
+            counts = self.mask.sum(axis=1)
+            sums = np.where(self.mask, self.values, 0.0).sum(axis=1)
+            return np.divide(
+                sums, counts, out=np.zeros(self.n_runs), where=counts > 0
+            ).tolist()
+        return [
+            (
+                sum(v for v, m in zip(row, mrow) if m) / count
+                if (count := sum(mrow))
+                else 0.0
+            )
+            for row, mrow in zip(self.values, self.mask)
+        ]
+
+    def geometric_mean(self) -> List[float]:
+        """Geometric mean of every run over its own positive values (others have no logarithm)"""
+        if (np := self.np) is not None:
+            mask = self.mask & (self.values > 0)
+            counts = mask.sum(axis=1)
+            logs = np.log(np.where(mask, self.values, 1.0)).sum(axis=1)
+            means = np.divide(logs, counts, out=np.zeros(self.n_runs), where=counts > 0)
+            return np.where(counts > 0, np.exp(means), 0.0).tolist()
+        scores = []
+        for row, mrow in zip(self.values, self.mask):
+            logs = [math.log(v) for v, m in zip(row, mrow) if m and v > 0]
+            scores.append(math.exp(sum(logs) / len(logs)) if logs else 0.0)
+        return scores
+
+    def normalized(self, baseline: int = 0) -> List[float]:
+        """
+        Geometric mean of the ratios to the baseline run,
+        over the benchmarks every run shares with the baseline (positive ratios only).
+        """
+        if self.n_runs == 0:
+            return []
+        if (np := self.np) is not None:
+            base = self.values[baseline]
+            ratios = self.values / np.where(base != 0, base, 1.0)
+            mask = self.mask & self.mask[baseline] & (base != 0) & (ratios > 0)
+            ratios = np.where(mask, ratios, 1.0)
+            counts = mask.sum(axis=1)
+            logs = np.log(ratios).sum(axis=1)
+            means = np.divide(logs, counts, out=np.zeros(self.n_runs), where=counts > 0)
+            return np.where(counts > 0, np.exp(means), 0.0).tolist()
+        base, bmask = self.values[baseline], self.mask[baseline]
+        scores = []
+        for row, mrow in zip(self.values, self.mask):
+            logs = [
+                math.log(v / b)
+                for v, m, b, bm in zip(row, mrow, base, bmask)
+                if m and bm and b != 0 and v / b > 0
+            ]
+            scores.append(math.exp(sum(logs) / len(logs)) if logs else 0.0)
+        return scores
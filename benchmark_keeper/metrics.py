@@ -0,0 +1,42 @@
+"""
+Selection of one named metric of benchmark results (see BenchmarkResult.metrics).
+
+The selected metric becomes the target of the results, so aggregators, label selections
+and statistics work on it like on the primary target.
+"""
+
+from typing import Iterable, List, Mapping, Optional, Tuple
+
+from benchmark_keeper import TARGET_METRIC, BenchmarkResult
+
+
+def select_metric(
+    benchmarks: Mapping[str, BenchmarkResult], metric: str
+) -> Mapping[str, BenchmarkResult]:
+    """Results with the metric as their target. Benchmarks without it are left out."""
+    if metric == TARGET_METRIC:
+        return benchmarks
+    return {
+        name: selected
+        for name, result in benchmarks.items()
+        if (selected := result.metric(metric)) is not None
+    }
+
+
+def metric_kind(
+    runs: Iterable[Mapping[str, BenchmarkResult]], metric: str
+) -> Optional[Tuple[str, bool]]:
+    """(unit, lower_is_better) of the metric as recorded with the first result measuring it"""
+    for benchmarks in runs:
+        for result in benchmarks.values():
+            if (m := result.metrics.get(metric)) is not None:
+                return m.unit, m.lower_is_better
+    return None
+
+
+def metric_names(runs: Iterable[Mapping[str, BenchmarkResult]]) -> List[str]:
+    return sorted(
+        {TARGET_METRIC}.union(
+            *(result.metrics for benchmarks in runs for result in benchmarks.values())
+        )
+    )
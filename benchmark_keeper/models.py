@@ -0,0 +1,214 @@
+"""
+Pydantic models of the configs and runs.
+Imported on first use of one of them (see benchmark_keeper.__getattr__), so commands that neither
+read configs nor runs don't import pydantic.
+"""
+
+import functools
+import hashlib
+import pathlib
+import typing
+from typing import Any, List, Mapping, Optional
+
+from pydantic import BaseModel
+from pydantic.dataclasses import dataclass
+
+from benchmark_keeper import TARGET_METRIC, OutputFormat, Statistic, Storage
+
+
+class LocalConfig(BaseModel):
+    machine_name: str
+    active_experiment: str | None
+    cache_size_mb: int = 64
+    worktree_pool_size: int = 2
+
+
+default_local_config = LocalConfig(machine_name="MyMachine", active_experiment=None)
+
+
+class Experiment(BaseModel):
+    name: str
+    version: int = 1
+    build_script: str | None = None
+    test_script: str | None = None
+    benchmark_script: str
+    watch_files: List[str] = []  # Files, directories or glob patterns
+    watch_git: bool = False  # Digest staged blob ids of watch_files instead of contents
+    output_format: OutputFormat = OutputFormat.json
+    benchmark_timeout: float | None = (
+        None  # Seconds to wait for the next result (jsonl)
+    )
+    suite_timeout: float | None = None  # Seconds for one run of benchmark_script
+    # Prints the time of a fixed workload, used to compare runs across machines
+    calibration_script: str | None = None
+    # Environment of benchmark_script (and calibration_script)
+    cpu_affinity: List[int] | None = None  # CPUs it may run on
+    nice: int | None = None  # Niceness increment
+    env: Mapping[str, str] = {}  # Variables to set
+    unset_env: List[str] = []  # Variables to remove
+
+
+class RepoConfig(BaseModel):
+    experiments: List[Experiment]
+    storage: Storage = Storage.report
+
+
+default_repo_config = RepoConfig(experiments=[])
+
+
+@dataclass
+class AppConfig:
+    root_directory: pathlib.Path
+    local_config: LocalConfig
+    repo_config: RepoConfig
+
+    @property
+    def active_experiment(self) -> Optional[Experiment]:
+        return next(
+            filter(
+                lambda x: x.name == self.local_config.active_experiment,
+                self.repo_config.experiments,
+            ),
+            None,
+        )
+
+
+class SampleStats(BaseModel):
+    """Summary of repeated samples of one benchmark. ci_* bound the 95% CI of the median."""
+
+    median: float
+    mean: float
+    min: float
+    mad: float
+    ci_low: float
+    ci_high: float
+
+
+class Metric(BaseModel):
+    """A further named measurement of a benchmark, e.g. throughput or peak memory"""
+
+    value: float
+    unit: str = "unit"
+    lower_is_better: bool = True
+    samples: List[float] = []
+    stats: SampleStats | None = None
+
+
+class BenchmarkResult(BaseModel):
+    """
+    The result of one benchmark. target is the primary metric (e.g. time in ns), metrics holds further ones.
+    If the benchmark was repeated, samples holds all measurements and target their median (likewise per metric).
+    """
+
+    target: float
+    labels: List[str] = []
+    unstructured: Mapping[str, Any] = {}
+    samples: List[float] = []
+    stats: SampleStats | None = None
+    metrics: Mapping[str, Metric] = {}
+
+    def statistic(self, statistic: Statistic) -> float:
+        if statistic == Statistic.target or self.stats is None:
+            return self.target
+        return getattr(self.stats, statistic.value)
+
+    def metric(self, name: str) -> Optional["BenchmarkResult"]:
+        """This result with the given metric as its target, None if it wasn't measured"""
+        if name == TARGET_METRIC:
+            return self
+        if (metric := self.metrics.get(name)) is None:
+            return None
+        return BenchmarkResult(
+            target=metric.value,
+            labels=self.labels,
+            samples=metric.samples,
+            stats=metric.stats,
+        )
+
+
+class ResourceUsage(BaseModel):
+    """Resources used by one phase (build, test or benchmark), including child processes"""
+
+    wall_time: float  # s
+    user_time: float  # s
+    system_time: float  # s
+    max_rss: int  # KiB
+    voluntary_switches: int
+    involuntary_switches: int
+
+
+class Fingerprint(BaseModel):
+    """Machine and environment a run was measured in"""
+
+    cpu_model: str | None = None
+    cores: int | None = None
+    governor: str | None = None  # CPU frequency scaling governor
+    kernel: str | None = None
+    load_average: float | None = None  # 1 minute load average at the start
+    python: str | None = None
+    compiler: str | None = None  # First line of `cc --version`
+
+    def mismatches(self, other: "Fingerprint") -> List[str]:
+        """Fields (except the load average) that are known in both and differ"""
+        return [
+            field
+            for field in Fingerprint.model_fields
+            if field != "load_average"
+            and (a := getattr(self, field)) is not None
+            and (b := getattr(other, field)) is not None
+            and a != b
+        ]
+
+
+class BenchmarkRun(BaseModel):
+    """
+    Contains results of multiple benchmarks within one (experiment,version).
+    The tag uniquely identifies this run.
+    A run is incomplete if the benchmark script failed or timed out after some results.
+    """
+
+    tag: str
+    experiment: str
+    experiment_version: int
+    machine: str
+    benchmarks: Mapping[str, BenchmarkResult]
+    file_digest: str = ""
+    incomplete: bool = False
+    resources: Mapping[str, ResourceUsage] = {}
+    calibration: float | None = None  # Output of calibration_script
+    fingerprint: Fingerprint | None = None
+
+
+class Report(BaseModel):
+    """
+    Persisted runs across different experiments/versions.
+    Should contain, for every (experiment, experiment_version) pair at most one run.
+    """
+
+    runs: List[BenchmarkRun]
+
+
+@functools.lru_cache
+def schema_digest(*models: type) -> str:
+    """
+    Digest of the fields of the models and of the models nested in them.
+    Caches of parsed models are keyed by it: data parsed by a version with other fields
+    (e.g. without a field added since, which pydantic drops) must not be served.
+    Much cheaper than hashing model_json_schema(), which is computed on every startup.
+    """
+    h = hashlib.sha256(usedforsecurity=False)
+    pending, seen = list(models), set()
+    while pending:
+        model = pending.pop(0)
+        if model in seen:
+            continue
+        seen.add(model)
+        for name, field in model.__pydantic_fields__.items():
+            h.update(f"{model.__name__}.{name}: {field.annotation!r}\n".encode())
+            types = [field.annotation]
+            while types:
+                t = types.pop()
+                types.extend(typing.get_args(t))
+                if isinstance(t, type) and hasattr(t, "__pydantic_fields__"):
+                    pending.append(t)
+    return h.hexdigest()[:16]
@@ -0,0 +1,84 @@
+"""
+Run storage in git notes. The runs measured at a commit are attached to it as a note in NOTES_REF,
+holding a report in the format of report.yml (one run per experiment).
+Notes can be added to past commits without new commits, and all of them are found with one git call.
+Share them with `git push <remote> refs/notes/benchk` (and fetch them likewise).
+"""
+
+import os
+import subprocess
+import tempfile
+from typing import Dict, Mapping, Optional
+
+import typer
+
+from benchmark_keeper import print_error
+
+NOTES_REF = "refs/notes/benchk"
+
+
+def _git(*args: str, input: Optional[str] = None) -> str:
+    proc = subprocess.run(["git", *args], input=input, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print_error("Git command failed", proc.stderr.strip())
+        raise typer.Exit(1)
+    return proc.stdout
+
+
+def notes_oid() -> Optional[str]:
+    """Commit of NOTES_REF, None if there are no notes"""
+    proc = subprocess.run(
+        ["git", "rev-parse", "--verify", "--quiet", NOTES_REF],
+        capture_output=True,
+        text=True,
+    )
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+
+def list_notes() -> Dict[str, str]:
+    """Maps annotated commits to the blob ids of their notes"""
+    notes = {}
+    for line in _git("notes", "--ref", NOTES_REF, "list").splitlines():
+        blob, commit = line.split()
+        notes[commit] = blob
+    return notes
+
+
+def write_notes(contents: Mapping[str, bytes], message: str):
+    """
+    Sets the notes of the given commits (replacing existing ones) with a single commit to NOTES_REF.
+    Unlike `git notes add`, this costs a fixed number of git calls for any number of notes.
+    """
+    if not contents:
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i, content in enumerate(contents.values()):
+            paths.append(os.path.join(tmp, str(i)))
+            with open(paths[-1], "wb") as f:
+                f.write(content)
+        blobs = _git(
+            "hash-object", "-w", "--stdin-paths", input="\n".join(paths)
+        ).split()
+
+    parent = notes_oid()
+    entries = list_notes() if parent is not None else {}
+    entries.update(zip(contents, blobs))
+    # Notes trees may be flat, git fans them out on its own later
+    tree = _git(
+        "mktree",
+        input="".join(
+            f"100644 blob {blob}\t{commit}\n" for commit, blob in entries.items()
+        ),
+    ).strip()
+    if parent is not None and tree == _git("rev-parse", f"{parent}^{{tree}}").strip():
+        return
+    commit = _git(
+        "commit-tree",
+        tree,
+        *(("-p", parent) if parent is not None else ()),
+        "-m",
+        message,
+    ).strip()
+    # Fails if another process moved the ref meanwhile
+    _git("update-ref", NOTES_REF, commit, parent or "")
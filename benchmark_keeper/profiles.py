@@ -0,0 +1,118 @@
+"""
+Profiles of benchmark runs, stored in LOCAL_DIR in collapsed stack format
+("frame;frame;frame value" per line), keyed by the run tag.
+
+Benchmark scripts with a Python shebang are run under cProfile.
+Any script may also write collapsed stacks (e.g. from py-spy or perf + stackcollapse)
+to <name>.folded files in the directory given by $BENCHK_PROFILE_DIR.
+The first frame of every stored stack is the benchmark (or script) name.
+"""
+
+import gzip
+import os
+import pathlib
+import pstats
+import shlex
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from benchmark_keeper import LOCAL_DIR, PROFILE_DIR, get_path
+
+PROFILE_ENV = "BENCHK_PROFILE_DIR"
+_CPROFILE_OUT = "cprofile.pstats"
+
+# cProfile times are stored as integer microseconds
+_SCALE = 10**6
+
+
+def profiled_command(script: pathlib.Path, profile_dir: pathlib.Path) -> List[str]:
+    """Runs script under cProfile if its shebang names a Python interpreter"""
+    with open(script, "rb") as f:
+        first = f.readline().decode(errors="replace")
+    if first.startswith("#!") and "python" in first:
+        interpreter = shlex.split(first[2:])
+        return [
+            *interpreter,
+            "-m",
+            "cProfile",
+            "-o",
+            str(profile_dir.joinpath(_CPROFILE_OUT)),
+            str(script),
+        ]
+    return [str(script)]
+
+
+def _frame(func) -> str:
+    file, line, name = func
+    return f"{name} ({os.path.basename(file)}:{line})" if line else name
+
+
+def pstats_stacks(path: pathlib.Path, root: str) -> Dict[str, int]:
+    """
+    cProfile only records callers, so stacks are two frames deep (caller;callee),
+    weighted by the callee's self time spent in calls from that caller.
+    """
+    stacks: Dict[str, int] = defaultdict(int)
+    for func, (_, _, tottime, _, callers) in pstats.Stats(str(path)).stats.items():  # type: ignore
+        if not callers:
+            stacks[f"{root};{_frame(func)}"] += round(tottime * _SCALE)
+        for caller, (_, _, caller_tottime, _) in callers.items():
+            stacks[f"{root};{_frame(caller)};{_frame(func)}"] += round(
+                caller_tottime * _SCALE
+            )
+    return {stack: value for stack, value in stacks.items() if value > 0}
+
+
+def parse_folded(lines, root: Optional[str] = None) -> Dict[str, int]:
+    stacks: Dict[str, int] = defaultdict(int)
+    for line in lines:
+        stack, _, value = line.strip().rpartition(" ")
+        if not stack:
+            continue
+        try:
+            stacks[f"{root};{stack}" if root else stack] += int(float(value))
+        except ValueError:
+            continue
+    return dict(stacks)
+
+
+def collect_profile(profile_dir: pathlib.Path, script_name: str) -> Dict[str, int]:
+    stacks: Dict[str, int] = {}
+    if (out := profile_dir.joinpath(_CPROFILE_OUT)).exists():
+        stacks.update(pstats_stacks(out, script_name))
+    for folded in sorted(profile_dir.glob("*.folded")):
+        with open(folded) as f:
+            stacks.update(parse_folded(f, folded.stem))
+    return stacks
+
+
+def _profile_path(tag: str) -> pathlib.Path:
+    return get_path().joinpath(LOCAL_DIR, PROFILE_DIR, f"{tag}.folded.gz")
+
+
+def save_profile(tag: str, stacks: Dict[str, int]):
+    path = _profile_path(tag)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "wt") as f:
+        for stack, value in sorted(stacks.items()):
+            f.write(f"{stack} {value}\n")
+
+
+def load_profile(tag: str) -> Optional[Dict[str, int]]:
+    if not (path := _profile_path(tag)).exists():
+        return None
+    with gzip.open(path, "rt") as f:
+        return parse_folded(f)
+
+
+def self_times(
+    stacks: Dict[str, int], benchmark: Optional[str] = None
+) -> Dict[str, int]:
+    """Sums the values of stacks by their leaf frame, optionally for one benchmark only"""
+    times: Dict[str, int] = defaultdict(int)
+    for stack, value in stacks.items():
+        frames = stack.split(";")
+        if benchmark is not None and frames[0] != benchmark:
+            continue
+        times[frames[-1]] += value
+    return dict(times)
@@ -1,19 +1,43 @@
-import subprocess, yaml
+import json, os, subprocess
+from contextlib import contextmanager
 from enum import Enum
-from typing import List, Tuple
+from threading import Lock
+from typing import Dict, List, Mapping, Optional, Tuple
 from pydantic import ValidationError
 import typer
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
 from benchmark_keeper import (
+    LOCAL_DIR,
+    PENDING_REPORT,
+    REPORT_CACHE,
     REPORT_FILE,
+    REPORT_LOCK,
     TRACKED_DIR,
     BenchmarkRun,
     app,
     console,
+    get_config,
     get_path,
     Report,
+    Storage,
+    is_racy,
     print_error,
+    stat_key,
+)
+from benchmark_keeper.git import batch_check, batch_read, rev_parse, worktree_clean
+from benchmark_keeper.local_runs import (
+    add_commit_run,
+    get_local_runs,
+    remove_commit_runs,
 )
+from benchmark_keeper.models import schema_digest
+from benchmark_keeper.notes import list_notes, notes_oid, write_notes
+from benchmark_keeper.shards import parse_shard, read_shard, shard_path, write_shard
 
 
 class DataRetrieveFailure(Enum):
@@ -22,21 +46,70 @@ class DataRetrieveFailure(Enum):
     RUN_MISSING = 3
 
 
-def write_runs(runs: Report):
-    with open(get_path().joinpath(TRACKED_DIR, REPORT_FILE), "w") as f:
-        yaml.safe_dump(runs.model_dump(), f)
+_report_lock = Lock()
+
+
+@contextmanager
+def report_lock():
+    """Serializes read-modify-write cycles of runs across threads and processes"""
+    path = get_path().joinpath(LOCAL_DIR)
+    path.mkdir(exist_ok=True)
+    with _report_lock, open(path.joinpath(REPORT_LOCK), "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
 
+def dump_report(runs: Report) -> str:
+    import yaml
+
+    return yaml.safe_dump(runs.model_dump(exclude_defaults=True))
+
+
+def write_runs(runs: Report, pending: bool = False):
+    """Writes report.yml, or the report of runs waiting for a commit (notes storage)"""
+    path = (
+        get_path().joinpath(LOCAL_DIR, PENDING_REPORT)
+        if pending
+        else get_path().joinpath(TRACKED_DIR, REPORT_FILE)
+    )
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(dump_report(runs))
+    os.replace(tmp_path, path)
 
-def read_runs() -> Report | DataRetrieveFailure:
-    path = get_path().joinpath(TRACKED_DIR, REPORT_FILE)
+
+def read_runs(pending: bool = False) -> Report | DataRetrieveFailure:
+    path = (
+        get_path().joinpath(LOCAL_DIR, PENDING_REPORT)
+        if pending
+        else get_path().joinpath(TRACKED_DIR, REPORT_FILE)
+    )
     if not path.exists():
-        write_runs(Report(runs=[]))
-    with open(path, "r") as f:
-        content = f.read()
+        write_runs(Report(runs=[]), pending)
+
+    # The parsed report is cached as JSON keyed by its stat_key, like the configs,
+    # so reading the current run doesn't need yaml
+    key = [str(path), *stat_key(path), schema_digest(Report)]
+    cache_path = get_path().joinpath(LOCAL_DIR, REPORT_CACHE)
     try:
-        return Report(**yaml.safe_load(content))
-    except (ValidationError, yaml.YAMLError):
-        return DataRetrieveFailure.BAD_FORMAT
+        cached = json.loads(cache_path.read_text())
+        if cached["key"] == key:
+            return Report.model_validate(cached["report"])
+    except (OSError, ValueError, KeyError, TypeError, ValidationError):
+        pass
+
+    with open(path, "r") as f:
+        report = parse_report(f.read())
+    if (
+        isinstance(report, Report)
+        and not is_racy(stat_key(path))
+        and cache_path.parent.exists()
+    ):
+        cache_path.write_text(
+            json.dumps({"key": key, "report": report.model_dump(mode="json")})
+        )
+    return report
 
 
 def unique_runs(runs: List[BenchmarkRun]) -> List[BenchmarkRun]:
@@ -50,16 +123,84 @@ def unique_runs(runs: List[BenchmarkRun]) -> List[BenchmarkRun]:
     return list(filter(ffunc, runs))
 
 
+def is_sharded() -> bool:
+    return get_config().repo_config.storage == Storage.sharded
+
+
+def is_notes() -> bool:
+    return get_config().repo_config.storage == Storage.notes
+
+
 def add_run(run: BenchmarkRun):
-    if not isinstance((runs := read_runs()), Report):
-        print_error(
-            f"{REPORT_FILE} file badly formatted. Fix or delete it to continue."
+    with report_lock():
+        if is_sharded():
+            write_shard(run)
+            return
+
+        if is_notes():
+            # A run of a clean working tree measured HEAD itself
+            if worktree_clean() and (head := rev_parse("HEAD")) is not None:
+                add_note_runs({head: [run]})
+                runs = read_runs(pending=True)
+                if isinstance(runs, Report) and runs.runs:
+                    write_runs(
+                        Report(
+                            runs=[
+                                r
+                                for r in runs.runs
+                                if (r.experiment, r.experiment_version)
+                                != (run.experiment, run.experiment_version)
+                            ]
+                        ),
+                        pending=True,
+                    )
+                return
+            console.print(
+                "Uncommitted changes: the run waits for a commit (see notes attach)"
+            )
+
+        if not isinstance((runs := read_runs(pending=is_notes())), Report):
+            print_error(
+                f"{REPORT_FILE} file badly formatted. Fix or delete it to continue."
+            )
+            raise typer.Exit(1)
+
+        new_runs = unique_runs([run] + runs.runs)
+
+        write_runs(Report(runs=new_runs), pending=is_notes())
+
+
+def add_note_runs(
+    commit_runs: Mapping[str, List[BenchmarkRun]], message: str = "Add benchmark runs"
+):
+    """
+    Adds runs to the notes of commits in one batch, replacing runs of the same experiment versions.
+    Local runs of those commits are dropped, since they would shadow the notes.
+    """
+    notes = list_notes() if notes_oid() is not None else {}
+    existing = dict(batch_read({notes[c] for c in commit_runs if c in notes}))
+    contents = {}
+    for commit, runs in commit_runs.items():
+        note = (
+            parse_report(existing[notes[commit]])
+            if notes.get(commit) in existing
+            else None
         )
-        raise typer.Exit(1)
+        old = note.runs if isinstance(note, Report) else []
+        contents[commit] = dump_report(Report(runs=unique_runs(runs + old))).encode()
+    write_notes(contents, message)
+    remove_commit_runs(
+        (commit, run) for commit, runs in commit_runs.items() for run in runs
+    )
 
-    new_runs = unique_runs([run] + runs.runs)
 
-    write_runs(Report(runs=new_runs))
+def add_past_run(commit: str, run: BenchmarkRun):
+    """Stores a run measured at a past commit: in its note with notes storage, locally otherwise"""
+    if is_notes():
+        with report_lock():
+            add_note_runs({commit: [run]})
+    else:
+        add_commit_run(commit, run)
 
 
 def find_run(runs: Report | DataRetrieveFailure, exp_pair: Tuple[str, int]):
@@ -73,24 +214,218 @@ def find_run(runs: Report | DataRetrieveFailure, exp_pair: Tuple[str, int]):
             return runs
 
 
+def parse_report(content: str | bytes) -> Report | DataRetrieveFailure:
+    # Parsed reports are mostly served from the run cache, so yaml is imported on demand
+    import yaml
+
+    try:
+        return Report(**yaml.safe_load(content))
+    except (ValidationError, yaml.YAMLError, TypeError):
+        return DataRetrieveFailure.BAD_FORMAT
+
+
+def parse_shard_report(content: str | bytes) -> Report | DataRetrieveFailure:
+    try:
+        return Report(runs=[parse_shard(content)])
+    except (ValidationError, ValueError, TypeError):
+        return DataRetrieveFailure.BAD_FORMAT
+
+
+# Committed runs never change, so they are kept for the lifetime of the process
+# (which matters for serve), as long as no notes are added
+_commit_runs: Dict[Tuple[str, str, int], BenchmarkRun | DataRetrieveFailure] = {}
+_notes_oid: Optional[str] = None
+
+
+def get_commit_runs(
+    commits: List[str], experiment: str, experiment_version: int
+) -> Dict[str, BenchmarkRun | DataRetrieveFailure]:
+    """Loads the run of every given commit. Only commits not loaded before are read."""
+    global _notes_oid
+    if (oid := notes_oid()) != _notes_oid:
+        _commit_runs.clear()
+        _notes_oid = oid
+    missing = [
+        commit
+        for commit in commits
+        if (commit, experiment, experiment_version) not in _commit_runs
+    ]
+    if missing:
+        for commit, run in _load_commit_runs(
+            missing, experiment, experiment_version
+        ).items():
+            _commit_runs[commit, experiment, experiment_version] = run
+    return {
+        commit: _commit_runs[commit, experiment, experiment_version]
+        for commit in commits
+    }
+
+
+def _load_commit_runs(
+    commits: List[str], experiment: str, experiment_version: int
+) -> Dict[str, BenchmarkRun | DataRetrieveFailure]:
+    """
+    Report blobs are resolved in one pass and every distinct blob is parsed only once,
+    since consecutive commits usually share the same report.
+    Parsed reports are kept in the run cache, so only new reports are parsed.
+    A note of a commit takes precedence over the report in its tree, for the experiments it holds.
+    """
+    from benchmark_keeper.cache import RunCache
+
+    notes = list_notes() if _notes_oid is not None else {}
+
+    # Commits from before a migration only have the report file
+    report_names = [f"{commit}:{TRACKED_DIR}/{REPORT_FILE}" for commit in commits]
+    shard_names = [
+        f"{commit}:{shard_path(experiment, experiment_version)}" for commit in commits
+    ]
+
+    with RunCache(get_config().local_config.cache_size_mb * 2**20) as cache:
+        # Commits are immutable, so their report blob only has to be resolved once
+        object_names = report_names + shard_names
+        blob_ids = cache.get_blob_ids(object_names)
+        unresolved = [name for name in object_names if name not in blob_ids]
+        resolved = dict(zip(unresolved, batch_check(unresolved)))
+        cache.put_blob_ids(resolved)
+        blob_ids.update(resolved)
+
+        # Blobs that may hold the run of each commit, by precedence
+        commit_blobs = [
+            [
+                oid
+                for oid in (
+                    notes.get(commit),
+                    blob_ids[shard_name],
+                    blob_ids[report_name],
+                )
+                if oid is not None
+            ]
+            for commit, report_name, shard_name in zip(
+                commits, report_names, shard_names
+            )
+        ]
+        shard_blobs = {blob_ids[name] for name in shard_names}
+
+        distinct = {oid for oids in commit_blobs for oid in oids}
+        reports = cache.get_reports(distinct)
+        parsed: Dict[str, Report | None] = {}
+        for oid, content in batch_read(distinct.difference(reports)):
+            report = (
+                parse_shard_report(content)
+                if oid in shard_blobs
+                else parse_report(content)
+            )
+            parsed[oid] = report if isinstance(report, Report) else None
+        cache.put_reports(parsed)
+        reports.update(parsed)
+
+    blob_runs: Dict[str, BenchmarkRun | DataRetrieveFailure] = {
+        oid: find_run(
+            report if report is not None else DataRetrieveFailure.BAD_FORMAT,
+            (experiment, experiment_version),
+        )
+        for oid, report in reports.items()
+    }
+
+    def commit_run(oids: List[str]) -> BenchmarkRun | DataRetrieveFailure:
+        """The run of the first blob holding one, else the failure of the first blob"""
+        runs = [blob_runs.get(oid, DataRetrieveFailure.FILE_MISSING) for oid in oids]
+        return next(
+            (run for run in runs if isinstance(run, BenchmarkRun)),
+            runs[0] if runs else DataRetrieveFailure.FILE_MISSING,
+        )
+
+    return {commit: commit_run(oids) for commit, oids in zip(commits, commit_blobs)}
+
+
+def get_history(
+    commits: List[str], experiment: str, experiment_version: int
+) -> Dict[str, BenchmarkRun | DataRetrieveFailure]:
+    """
+    Runs of the given commits (newest first) from committed reports, overridden by runs
+    recorded locally against past commits. If the oldest commit carrying a committed run
+    was measured again, that run is dropped from all later commits carrying it.
+    """
+    commit_runs = get_commit_runs(commits, experiment, experiment_version)
+    local_runs = get_local_runs(experiment, experiment_version)
+    if not local_runs:
+        return commit_runs
+
+    owners: Dict[str, str] = {}
+    for commit in reversed(commits):
+        if isinstance(run := commit_runs[commit], BenchmarkRun):
+            owners.setdefault(run.tag, commit)
+    superseded = {tag for tag, commit in owners.items() if commit in local_runs}
+    return {
+        commit: (
+            local_runs[commit]
+            if commit in local_runs
+            else (
+                DataRetrieveFailure.RUN_MISSING
+                if isinstance(run, BenchmarkRun) and run.tag in superseded
+                else run
+            )
+        )
+        for commit, run in commit_runs.items()
+    }
+
+
+def get_own_runs(
+    commits: List[str], experiment: str, experiment_version: int
+) -> Dict[str, BenchmarkRun]:
+    """
+    Runs measured at each commit (oldest first). A commit carrying the same run (tag)
+    as an earlier commit didn't measure it, so it is left out.
+    """
+    seen = set()
+    runs: Dict[str, BenchmarkRun] = {}
+    history = get_history(commits[::-1], experiment, experiment_version)
+    for commit in commits:
+        run = history[commit]
+        if isinstance(run, BenchmarkRun) and run.tag not in seen:
+            seen.add(run.tag)
+            runs[commit] = run
+    return runs
+
+
+def get_machine_pairs(
+    commits: List[str], experiment: str, experiment_version: int
+) -> List[Tuple[BenchmarkRun, BenchmarkRun]]:
+    """Committed and local runs of the same commit, measured on different machines"""
+    local_runs = get_local_runs(experiment, experiment_version)
+    committed = get_commit_runs(
+        [commit for commit in commits if commit in local_runs],
+        experiment,
+        experiment_version,
+    )
+    return [
+        (run, local_runs[commit])
+        for commit, run in committed.items()
+        if isinstance(run, BenchmarkRun) and run.machine != local_runs[commit].machine
+    ]
+
+
 def get_commit_run(
     commit_id: str, experiment: str, experiment_version: int
 ) -> BenchmarkRun | DataRetrieveFailure:
-    proc = subprocess.run(
-        ["git", "show", f"{commit_id}:{TRACKED_DIR+'/'+REPORT_FILE}"],
-        capture_output=True,
-        text=True,
-    )
-    if proc.stdout is None:
-        return DataRetrieveFailure.FILE_MISSING
-    try:
-        runs = Report(**yaml.safe_load(proc.stdout))
-        return find_run(runs, (experiment, experiment_version))
-    except (ValidationError, yaml.YAMLError):
-        return DataRetrieveFailure.BAD_FORMAT
+    return get_history([commit_id], experiment, experiment_version)[commit_id]
 
 
 def get_current_run(
     experiment: str, experiment_version: int
 ) -> BenchmarkRun | DataRetrieveFailure:
+    if is_sharded():
+        try:
+            run = read_shard(experiment, experiment_version)
+        except (ValidationError, ValueError, TypeError):
+            return DataRetrieveFailure.BAD_FORMAT
+        return run if run is not None else DataRetrieveFailure.RUN_MISSING
+    if is_notes():
+        pending = find_run(read_runs(pending=True), (experiment, experiment_version))
+        if (
+            pending != DataRetrieveFailure.RUN_MISSING
+            or (head := rev_parse("HEAD")) is None
+        ):
+            return pending
+        return get_commit_run(head, experiment, experiment_version)
     return find_run(read_runs(), (experiment, experiment_version))
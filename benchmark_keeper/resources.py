@@ -0,0 +1,73 @@
+"""Resource usage of child processes, measured with os.wait4"""
+
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+import typer
+
+from benchmark_keeper import BenchmarkResult, BenchmarkRun, ResourceUsage, print_error
+
+# ru_maxrss is in bytes on macOS, KiB elsewhere
+_RSS_DIVISOR = 1024 if sys.platform == "darwin" else 1
+
+
+def wait_usage(proc: subprocess.Popen, start: float) -> Tuple[int, ResourceUsage]:
+    """
+    Waits for proc (started at time.monotonic() == start) and returns its exit code
+    and resource usage.
+    """
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, ResourceUsage(
+        wall_time=time.monotonic() - start,
+        user_time=rusage.ru_utime,
+        system_time=rusage.ru_stime,
+        max_rss=rusage.ru_maxrss // _RSS_DIVISOR,
+        voluntary_switches=rusage.ru_nvcsw,
+        involuntary_switches=rusage.ru_nivcsw,
+    )
+
+
+def combine(a: Optional[ResourceUsage], b: ResourceUsage) -> ResourceUsage:
+    """Usage of two consecutive runs of a phase. Times add up, max_rss is the maximum."""
+    if a is None:
+        return b
+    return ResourceUsage(
+        wall_time=a.wall_time + b.wall_time,
+        user_time=a.user_time + b.user_time,
+        system_time=a.system_time + b.system_time,
+        max_rss=max(a.max_rss, b.max_rss),
+        voluntary_switches=a.voluntary_switches + b.voluntary_switches,
+        involuntary_switches=a.involuntary_switches + b.involuntary_switches,
+    )
+
+
+def record(
+    resources: Optional[Dict[str, ResourceUsage]], phase: str, usage: ResourceUsage
+):
+    if resources is not None:
+        resources[phase] = combine(resources.get(phase), usage)
+
+
+def parse_resource(resource: str) -> Tuple[str, str]:
+    """Splits "phase.field", e.g. "build.wall_time" """
+    phase, _, field = resource.partition(".")
+    if field not in ResourceUsage.model_fields:
+        print_error(
+            f'Bad resource "{resource}".',
+            f"Expected <phase>.<field>, with field one of: {', '.join(ResourceUsage.model_fields)}",
+        )
+        raise typer.Exit(1)
+    return phase, field
+
+
+def resource_results(
+    run: BenchmarkRun, phase: str, field: str
+) -> Optional[Dict[str, BenchmarkResult]]:
+    """Resource usage of a run as a single result, so it can be aggregated like benchmarks"""
+    if (usage := run.resources.get(phase)) is None:
+        return None
+    return {f"{phase}.{field}": BenchmarkResult(target=getattr(usage, field))}
@@ -0,0 +1,61 @@
+"""
+Sharded run storage. Every (experiment, experiment_version) pair is stored in its own file,
+so reading or writing a run never touches the runs of other experiments.
+
+A shard is a JSON lines file: the first line holds the run without its benchmarks,
+every following line holds one [name, result] pair. This keeps diffs per benchmark
+and allows appending results as they arrive.
+"""
+
+import json
+import os
+from typing import Iterator
+from urllib.parse import quote
+
+from benchmark_keeper import RUNS_DIR, TRACKED_DIR, BenchmarkRun, get_path
+
+
+def shard_path(experiment: str, experiment_version: int) -> str:
+    """Path of a shard relative to the repository root"""
+    return f"{TRACKED_DIR}/{RUNS_DIR}/{quote(experiment, safe='')}/{experiment_version}.jsonl"
+
+
+def dump_shard(run: BenchmarkRun) -> Iterator[str]:
+    yield json.dumps(
+        run.model_dump(mode="json", exclude={"benchmarks"}, exclude_defaults=True),
+        separators=(",", ":"),
+    )
+    for name, result in run.benchmarks.items():
+        yield json.dumps(
+            [name, result.model_dump(mode="json", exclude_defaults=True)],
+            separators=(",", ":"),
+        )
+
+
+def parse_shard(content: str | bytes) -> BenchmarkRun:
+    """Raises ValueError (or ValidationError) if the shard is badly formatted"""
+    lines = content.splitlines()
+    if not lines:
+        raise ValueError("Empty shard")
+    return BenchmarkRun(
+        **json.loads(lines[0]),
+        benchmarks=dict(json.loads(line) for line in lines[1:] if line.strip()),
+    )
+
+
+def read_shard(experiment: str, experiment_version: int) -> BenchmarkRun | None:
+    path = get_path().joinpath(shard_path(experiment, experiment_version))
+    if not path.exists():
+        return None
+    with open(path, "r") as f:
+        return parse_shard(f.read())
+
+
+def write_shard(run: BenchmarkRun):
+    path = get_path().joinpath(shard_path(run.experiment, run.experiment_version))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        for line in dump_shard(run):
+            f.write(line + "\n")
+    os.replace(tmp_path, path)
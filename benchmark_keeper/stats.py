@@ -0,0 +1,152 @@
+"""Summary statistics of repeated benchmark samples"""
+
+import functools
+import math
+import statistics
+from enum import Enum
+from typing import Dict, List, Tuple
+
+from benchmark_keeper import BenchmarkResult, BenchmarkRun, SampleStats
+
+# Two sided 95% quantile of the standard normal distribution
+Z_95 = 1.959963984540054
+
+
+def median_ci(sorted_samples: List[float], z: float = Z_95) -> tuple[float, float]:
+    """
+    Distribution free confidence interval of the median, using order statistics
+    (normal approximation of the binomial distribution).
+    """
+    n = len(sorted_samples)
+    half_width = z * math.sqrt(n) / 2
+    lo = max(0, math.floor(n / 2 - half_width))
+    hi = min(n - 1, math.ceil(n / 2 + half_width) - 1)
+    return sorted_samples[lo], sorted_samples[hi]
+
+
+def summarize(samples: List[float]) -> SampleStats:
+    s = sorted(samples)
+    median = statistics.median(s)
+    ci_low, ci_high = median_ci(s)
+    return SampleStats(
+        median=median,
+        mean=statistics.fmean(s),
+        min=s[0],
+        mad=statistics.median(abs(x - median) for x in s),
+        ci_low=ci_low,
+        ci_high=ci_high,
+    )
+
+
+class Change(str, Enum):
+    faster = "faster"
+    slower = "slower"
+    noise = "noise"
+
+
+def mann_whitney_p(a: List[float], b: List[float]) -> float:
+    """
+    Two sided p-value of the Mann-Whitney U test, using the normal approximation
+    with tie and continuity correction.
+    """
+    n1, n2 = len(a), len(b)
+    n = n1 + n2
+    combined = sorted([(x, True) for x in a] + [(x, False) for x in b])
+
+    rank_sum_a = 0.0
+    tie_term = 0.0
+    i = 0
+    while i < n:
+        j = i
+        in_a = 0
+        while j < n and combined[j][0] == combined[i][0]:
+            in_a += combined[j][1]
+            j += 1
+        # Tied values get the average of ranks i+1..j
+        rank_sum_a += in_a * (i + j + 1) / 2
+        tie_term += (j - i) ** 3 - (j - i)
+        i = j
+
+    u = rank_sum_a - n1 * (n1 + 1) / 2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = max(abs(u - n1 * n2 / 2) - 0.5, 0) / sigma
+    return math.erfc(z / math.sqrt(2))
+
+
+@functools.lru_cache(maxsize=None)
+def min_attainable_p(n1: int, n2: int) -> float:
+    """Smallest p-value mann_whitney_p can return for these sample sizes (fully separated samples)"""
+    return mann_whitney_p(
+        [float(i) for i in range(n1)], [float(n1 + i) for i in range(n2)]
+    )
+
+
+def relative_change(base: BenchmarkResult, new: BenchmarkResult) -> float:
+    if base.target == 0:
+        return 0.0 if new.target == 0 else math.copysign(math.inf, new.target)
+    return new.target / base.target - 1
+
+
+def classify(
+    base: BenchmarkResult,
+    new: BenchmarkResult,
+    alpha: float = 0.05,
+    threshold: float = 0.01,
+    lower_is_better: bool = True,
+) -> Change:
+    """
+    Changes smaller than threshold (relative) are noise. If both results have
+    repeated samples, the change must also be significant at level alpha,
+    unless there are too few samples to ever reach it (e.g. 3 vs 3 at alpha 0.05).
+    An increase is slower, unless higher values are better (e.g. throughput).
+    """
+    change = relative_change(base, new)
+    if change == 0 or abs(change) < threshold:
+        return Change.noise
+    if (
+        len(base.samples) > 1
+        and len(new.samples) > 1
+        and min_attainable_p(len(base.samples), len(new.samples)) < alpha
+        and mann_whitney_p(base.samples, new.samples) >= alpha
+    ):
+        return Change.noise
+    return Change.slower if (change > 0) == lower_is_better else Change.faster
+
+
+def compare_runs(
+    base: BenchmarkRun,
+    new: BenchmarkRun,
+    alpha: float = 0.05,
+    threshold: float = 0.01,
+    lower_is_better: bool = True,
+) -> Dict[str, Tuple[Change, float]]:
+    """Classifies every benchmark present in both runs. Values are (change, relative change)."""
+    return {
+        name: (
+            classify(base.benchmarks[name], result, alpha, threshold, lower_is_better),
+            relative_change(base.benchmarks[name], result),
+        )
+        for name, result in new.benchmarks.items()
+        if name in base.benchmarks
+    }
+
+
+def run_ratio(
+    base: BenchmarkRun, run: BenchmarkRun, benchmark: str | None = None
+) -> float | None:
+    """
+    Ratio of run to base for one benchmark, or the geometric mean ratio over
+    all benchmarks present in both. None if there is nothing to compare.
+    """
+    names = [benchmark] if benchmark is not None else list(base.benchmarks)
+    logs = [
+        math.log(run.benchmarks[name].target / base.benchmarks[name].target)
+        for name in names
+        if name in base.benchmarks
+        and name in run.benchmarks
+        and base.benchmarks[name].target > 0
+        and run.benchmarks[name].target > 0
+    ]
+    return math.exp(sum(logs) / len(logs)) if logs else None
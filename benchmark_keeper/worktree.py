@@ -0,0 +1,106 @@
+"""
+Pool of git worktrees in LOCAL_DIR, used to build and benchmark past commits
+without touching the working tree.
+
+Every worktree remembers which source tree it has built, so benchmarking a commit
+whose tree was built before skips the build. When all worktrees are in use,
+the least recently used one is checked out again, keeping its (ignored) build outputs
+for incremental builds.
+"""
+
+import json
+import pathlib
+import subprocess
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator, Set, Tuple
+
+import typer
+
+from benchmark_keeper import LOCAL_DIR, WORKTREE_DIR, get_path, print_error
+
+_STATE_FILE = "state.json"
+
+
+def _git(*args: str, cwd: pathlib.Path | None = None) -> str:
+    proc = subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print_error("Git command failed", proc.stderr.strip())
+        raise typer.Exit(1)
+    return proc.stdout.strip()
+
+
+def tree_id(commit: str) -> str:
+    return _git("rev-parse", f"{commit}^{{tree}}")
+
+
+class WorktreePool(object):
+    """Thread safe: every checkout gets a worktree no one else is using."""
+
+    def __init__(self, size: int) -> None:
+        self.size = max(1, size)
+        self.path = get_path().joinpath(LOCAL_DIR, WORKTREE_DIR)
+        self.path.mkdir(parents=True, exist_ok=True)
+        state_path = self.path.joinpath(_STATE_FILE)
+        # slot -> {"tree": built tree id or None, "last_used": ns}
+        self.state: Dict[str, Dict] = (
+            json.loads(state_path.read_text()) if state_path.exists() else {}
+        )
+        self.busy: Set[str] = set()
+        self.lock = Lock()
+
+    def _save(self):
+        self.path.joinpath(_STATE_FILE).write_text(json.dumps(self.state))
+
+    def _pick_slot(self, tree: str) -> str:
+        for slot, entry in self.state.items():
+            if (
+                slot not in self.busy
+                and entry["tree"] == tree
+                and self.path.joinpath(slot).exists()
+            ):
+                return slot
+        free = [str(i) for i in range(self.size) if str(i) not in self.state]
+        if free:
+            return free[0]
+        idle = [slot for slot in self.state if slot not in self.busy]
+        if not idle:
+            raise RuntimeError("All worktrees are in use")
+        return min(idle, key=lambda slot: self.state[slot]["last_used"])
+
+    @contextmanager
+    def checkout(self, commit: str) -> Iterator[Tuple[pathlib.Path, bool]]:
+        """
+        Checks commit out into a worktree that is reserved until the context exits.
+        Yields the worktree and whether its tree has already been built there.
+        """
+        with self.lock:
+            tree = tree_id(commit)
+            slot = self._pick_slot(tree)
+            path = self.path.joinpath(slot)
+            if not path.exists():
+                _git("worktree", "prune")
+                _git("worktree", "add", "--detach", "--force", str(path), commit)
+            else:
+                _git("checkout", "--detach", "--force", "--quiet", commit, cwd=path)
+                _git("clean", "-fdq", cwd=path)
+
+            entry = self.state.get(slot, {"tree": None})
+            built = entry["tree"] == tree
+            self.state[slot] = {
+                "tree": tree if built else None,
+                "last_used": time.time_ns(),
+            }
+            self._save()
+            self.busy.add(slot)
+        try:
+            yield path, built
+        finally:
+            with self.lock:
+                self.busy.discard(slot)
+
+    def mark_built(self, path: pathlib.Path, commit: str):
+        with self.lock:
+            self.state[path.name]["tree"] = tree_id(commit)
+            self._save()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Startup time of the CLI, in the benchmark script format of benchmark-keeper
+(one JSON document mapping benchmark names to results, target in ns).
+
+Runs a few cheap commands in a scratch repository and reports the median wall time
+of each, plus the time to import the entry point.
+Usage: benchmarks/startup.py [repetitions]
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+COMMANDS = {
+    "startup.import": [sys.executable, "-c", "import benchmark_keeper.__main__"],
+    "startup.help": [sys.executable, "-m", "benchmark_keeper", "--help"],
+    "startup.switch": [sys.executable, "-m", "benchmark_keeper", "switch", "exp"],
+    "startup.list": [sys.executable, "-m", "benchmark_keeper", "list"],
+}
+
+REPO_CONFIG = """experiments:
+- name: exp
+  version: 1
+  benchmark_script: bench.sh
+"""
+
+
+def measure(cmd, cwd, env):
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter_ns()
+        subprocess.run(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter_ns() - start)
+    return samples
+
+
+def main():
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    with tempfile.TemporaryDirectory() as repo:
+        subprocess.run(["git", "init", "-q"], cwd=repo, check=True)
+        os.makedirs(os.path.join(repo, ".benchk"))
+        with open(os.path.join(repo, ".benchk", "repo_config.yml"), "w") as f:
+            f.write(REPO_CONFIG)
+        subprocess.run(
+            [
+                "git",
+                "-c",
+                "user.name=b",
+                "-c",
+                "user.email=b@b",
+                "commit",
+                "-q",
+                "--allow-empty",
+                "-m",
+                "init",
+            ],
+            cwd=repo,
+            check=True,
+        )
+        # Creates LOCAL_DIR and its config before measuring
+        subprocess.run(
+            COMMANDS["startup.switch"],
+            cwd=repo,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        # Config files modified in the last seconds are not cached
+        time.sleep(2.1)
+
+        results = {}
+        for name, cmd in COMMANDS.items():
+            samples = measure(cmd, repo, env)
+            results[name] = {"target": statistics.median(samples), "samples": samples}
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import time
+
+import pytest
+import typer
+from typer.testing import CliRunner
+
+from benchmark_keeper import Experiment, OutputFormat, app
+from benchmark_keeper.cmd import benchmark_cmd
+from benchmark_keeper.cmd.benchmark_cmd import run_benchmarks
+
+
+def _script(path, body):
+    path.write_text("#!/bin/sh\n" + body)
+    path.chmod(0o755)
+
+
+def _experiment(**kwargs):
+    return Experiment(
+        name="e",
+        benchmark_script="bench.sh",
+        output_format=OutputFormat.jsonl,
+        **kwargs,
+    )
+
+
+def _gone(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except FileNotFoundError:
+        return True
+
+
+def test_repetition_dying_mid_run(tmp_path):
+    # The second run dies after its first result
+    _script(
+        tmp_path / "bench.sh",
+        'echo \'{"name": "a", "target": 1, "labels": ["x"]}\'\n'
+        "if [ -e ran ]; then exit 1; fi\n"
+        "touch ran\n"
+        'echo \'{"name": "b", "target": 2}\'\n',
+    )
+    results, complete = run_benchmarks(_experiment(), repeat=3, cwd=tmp_path)
+
+    assert not complete
+    assert results["a"].samples == [1, 1]
+    assert results["a"].labels == ["x"]
+    assert results["b"].samples == [2]
+
+
+def test_interrupt_kills_script(tmp_path, monkeypatch):
+    _script(
+        tmp_path / "bench.sh",
+        "sleep 30 &\n" 'echo "{\\"name\\": \\"a\\", \\"target\\": $!}"\n' "wait\n",
+    )
+    pids = []
+
+    def interrupted(experiment, proc):
+        pids.append(int(proc.stdout.readline().split(":")[-1].strip(" }\n")))
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(benchmark_cmd, "stream_results", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run_benchmarks(_experiment(), cwd=tmp_path)
+
+    deadline = time.monotonic() + 5
+    while not _gone(pids[0]) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert _gone(pids[0])
+
+
+def test_failing_experiment_does_not_stop_the_others(monkeypatch):
+    ran, added = [], []
+
+    def benchmark_experiment(config, experiment, *args, **kwargs):
+        ran.append(experiment.name)
+        if experiment.name == "a":
+            raise typer.Exit(1)
+
+    experiments = [Experiment(name=name, benchmark_script="bench.sh") for name in "ab"]
+    monkeypatch.setattr(benchmark_cmd, "get_config", lambda: None)
+    monkeypatch.setattr(benchmark_cmd, "select_experiments", lambda *a: experiments)
+    monkeypatch.setattr(benchmark_cmd, "benchmark_experiment", benchmark_experiment)
+    monkeypatch.setattr(benchmark_cmd, "git_add_files", lambda: added.append(True))
+
+    result = CliRunner().invoke(app, ["benchmark", "--all"])
+
+    assert result.exit_code == 1
+    assert ran == ["a", "b"]
+    assert added
+    assert "Failed experiments: a" in result.output
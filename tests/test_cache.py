@@ -0,0 +1,19 @@
+from benchmark_keeper import Report, cache
+from benchmark_keeper.cache import RunCache
+
+
+def _cache(tmp_path, monkeypatch):
+    monkeypatch.setattr("benchmark_keeper._root_path", tmp_path)
+    return RunCache(2**20)
+
+
+def test_reports_of_other_schema_are_dropped(tmp_path, monkeypatch):
+    with _cache(tmp_path, monkeypatch) as c:
+        c.put_reports({"a": Report(runs=[]), "b": None})
+    with _cache(tmp_path, monkeypatch) as c:
+        assert c.get_reports(["a", "b"]) == {"a": Report(runs=[]), "b": None}
+
+    # A version of the models with other fields
+    monkeypatch.setattr(cache, "schema_digest", lambda *models: "other")
+    with _cache(tmp_path, monkeypatch) as c:
+        assert c.get_reports(["a", "b"]) == {}
@@ -0,0 +1,31 @@
+import os
+import pathlib
+import subprocess
+import sys
+
+import benchmark_keeper
+
+_ROOT = str(pathlib.Path(benchmark_keeper.__file__).parents[1])
+
+
+def _help(code: str) -> str:
+    proc = subprocess.run(
+        [sys.executable, "-c", code, "--help"],
+        env={**os.environ, "PYTHONPATH": _ROOT, "COLUMNS": "100"},
+        capture_output=True,
+        text=True,
+    )
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout
+
+
+def test_summaries_match_commands():
+    # --help lists the commands by their summaries, without importing them
+    summaries = _help(
+        "from benchmark_keeper.__main__ import main; main()",
+    )
+    loaded = _help(
+        "from benchmark_keeper import app; from benchmark_keeper.cmd import load_commands;"
+        "load_commands(); app()"
+    )
+    assert summaries == loaded
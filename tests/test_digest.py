@@ -0,0 +1,43 @@
+import os
+import pathlib
+import subprocess
+import sys
+
+import yaml
+
+import benchmark_keeper
+
+_ROOT = str(pathlib.Path(benchmark_keeper.__file__).parents[1])
+
+
+def _run(repo, *args):
+    return subprocess.run(
+        [sys.executable, "-m", "benchmark_keeper", *args],
+        cwd=repo,
+        env={**os.environ, "PYTHONPATH": _ROOT},
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_unchanged_tree_is_skipped(tmp_path):
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    (tmp_path / "bench.sh").write_text('#!/bin/sh\necho \'{"a": {"target": 1}}\'\n')
+    (tmp_path / "bench.sh").chmod(0o755)
+    (tmp_path / ".benchk").mkdir()
+    (tmp_path / ".benchk.local").mkdir()
+    experiment = {"name": "e", "benchmark_script": "./bench.sh", "watch_files": ["."]}
+    (tmp_path / ".benchk" / "repo_config.yml").write_text(
+        yaml.dump({"experiments": [experiment]})
+    )
+    (tmp_path / ".benchk.local" / "local_config.yml").write_text(
+        yaml.dump({"machine_name": "m", "active_experiment": "e"})
+    )
+
+    first = _run(tmp_path, "benchmark")
+    assert first.returncode == 0, first.stdout
+    assert "watched files are unchanged" not in first.stdout
+    # The first run wrote .benchk/report.yml, which is not a watched file
+    second = _run(tmp_path, "benchmark")
+    assert second.returncode == 0, second.stdout
+    assert "watched files are unchanged" in second.stdout
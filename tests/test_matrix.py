@@ -0,0 +1,37 @@
+import pytest
+
+from benchmark_keeper import BenchmarkResult
+from benchmark_keeper import matrix
+from benchmark_keeper.matrix import ResultMatrix
+
+
+def _runs(*runs):
+    return [
+        {name: BenchmarkResult(target=v) for name, v in run.items()} for run in runs
+    ]
+
+
+RUNS = _runs({"a": 4.0, "b": 0.0, "c": 1.0}, {"a": -2.0, "b": 8.0}, {"a": 0.0})
+
+
+@pytest.fixture(params=["python", "numpy"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+        monkeypatch.setattr(matrix, "_NUMPY_MIN_CELLS", 0)
+    else:
+        monkeypatch.setattr(matrix, "_load_numpy", lambda: None)
+    return request.param
+
+
+def _matrix():
+    return ResultMatrix(RUNS, lambda r: r.target)
+
+
+def test_geometric_mean_skips_non_positive(backend):
+    assert _matrix().geometric_mean() == pytest.approx([2.0, 8.0, 0.0])
+
+
+def test_normalized_skips_non_positive_ratios(backend):
+    # Only "a" is shared with the baseline, and its ratio is negative or zero in the other runs
+    assert _matrix().normalized(baseline=0) == pytest.approx([1.0, 0.0, 0.0])